@@ -22,9 +22,8 @@ import optparse
 
 from giscanner import message
 from giscanner.annotationparser import GtkDocCommentBlockParser, GtkDocCommentBlockWriter
-from giscanner.scannermain import (get_preprocessor_option_group,
-                                   create_source_scanner,
-                                   process_packages)
+from giscanner.scannermain import extract_filenames, get_preprocessor_option_group
+from giscanner.sourcescanner import SourceScanner
 
 
 def annotation_main(args):
@@ -50,12 +49,13 @@ def annotation_main(args):
     if not options.extract:
         raise SystemExit("ERROR: Nothing to do")
 
-    if options.packages:
-        process_packages(options, options.packages)
-
     logger = message.MessageLogger.get(namespace=None)
 
-    ss = create_source_scanner(options, args)
+    # The comments are extracted without running the preprocessor, the
+    # preprocessor options and packages are only accepted for
+    # compatibility
+    ss = SourceScanner()
+    ss.parse_comments(extract_filenames(args))
 
     if options.extract:
         parser = GtkDocCommentBlockParser()
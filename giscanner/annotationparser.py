@@ -1114,7 +1114,8 @@ class GtkDocCommentBlockParser(object):
         '''
         Parse multiple GTK-Doc comment blocks.
 
-        :param comments: an iterable of ``(comment, filename, lineno)`` tuples
+        :param comments: an iterable of ``(comment, filename, lineno)`` tuples, the file
+                         can also be given by ID, see :func:`message.intern_filename`
         :returns: a dictionary mapping identifier names to :class:`GtkDocCommentBlock` objects
         '''
 
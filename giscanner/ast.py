@@ -25,7 +25,6 @@ from itertools import chain
 from . import message
 
 from .collections import OrderedDict
-from .message import Position
 from .utils import to_underscores
 
 
@@ -478,6 +477,9 @@ functions via get_by_symbol()."""
     def get_by_symbol(self, symbol):
         return self.symbols.get(symbol)
 
+    def get_by_gtype_name(self, gtype_name):
+        return self.type_names.get(gtype_name)
+
     def walk(self, callback):
         for node in self.itervalues():
             node.walk(callback, [])
@@ -569,8 +571,8 @@ GIName.  It's possible for nodes to contain or point to other nodes."""
         self.file_positions.add(position)
 
     def add_symbol_reference(self, symbol):
-        if symbol.source_filename:
-            self.add_file_position(Position(symbol.source_filename, symbol.line))
+        if symbol.file_id is not None:
+            self.add_file_position(symbol.position)
 
     def walk(self, callback, chain):
         res = callback(self, chain)
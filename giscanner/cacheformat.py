@@ -0,0 +1,564 @@
+# -*- Mode: Python -*-
+# GObject-Introspection - a framework for introspecting GObject libraries
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+#
+
+"""Compact serialization of ast.Namespace objects for the cache store.
+
+The object graph reachable from a namespace is flattened into tables
+which reference objects by their index:
+
+ * objects are grouped by kind (a class from _get_classes() or one of
+   the _KIND_* containers) and numbered group after group, so that
+   every group can be created with a single call
+ * instance state is kept as a plain dictionary of attribute values;
+   references to other objects are stored as indices and listed in a
+   separate patch table
+ * strings are interned, so that marshal stores each of them once
+
+The tables are written with marshal, and none of the reconstruction
+steps runs Python code per object, only per group.  Dictionary keys
+and slot values have to be plain values; anything that can not be
+represented raises ValueError so that the caller can fall back to
+pickle.
+
+The cost per group makes small namespaces load at about the speed of
+cPickle; larger ones like Regress load about 2x faster in types only
+mode and 2.5x in full mode, see misc/benchmark-cache.py.
+
+The indexed format stores every top-level node in a table of its own,
+together with an index mapping GINames, ctypes, symbols and GType
+names to these tables.  It is loaded as a LazyNamespace, which only
+decodes the tables of the nodes which are actually looked up.  That
+is what makes it faster than the other formats, as loading all the
+nodes of a namespace one by one is slower than loading a pickle.
+"""
+
+import copy
+import gc
+import marshal
+import struct
+import time
+from itertools import repeat
+
+from . import ast
+from .collections import OrderedDict
+from .message import Position
+
+MAGIC = 'GISCANNER-NS\n'
+INDEXED_MAGIC = 'GISCANNER-NSX\n'
+
+# Bump whenever the layout of the tables changes
+FORMAT_VERSION = 1
+
+_MARSHAL_VERSION = 2
+
+(_KIND_PLAIN_LIST,
+ _KIND_REF_LIST,
+ _KIND_MIXED_LIST,
+ _KIND_DICT,
+ _KIND_ODICT,
+ _KIND_SET) = range(-1, -7, -1)
+
+_PLAIN_TYPES = (type(None), bool, int, long, float, str, unicode)
+
+_classes = None
+
+
+def _get_classes():
+    global _classes
+    if _classes is None:
+        classes = [Position]
+        for name in sorted(dir(ast)):
+            value = getattr(ast, name)
+            if isinstance(value, type) and value.__module__ == ast.__name__:
+                classes.append(value)
+        _classes = dict(('%s.%s' % (c.__module__, c.__name__), c) for c in classes)
+    return _classes
+
+
+def _is_plain(value):
+    value_type = type(value)
+    if value_type in _PLAIN_TYPES:
+        return True
+    if value_type in (tuple, frozenset):
+        for item in value:
+            if not _is_plain(item):
+                return False
+        return True
+    return False
+
+
+def _get_slots(cls):
+    # The state of some classes is not their slots, see Position
+    return getattr(cls, 'serialized_slots', cls.__slots__)
+
+
+def _intern(value):
+    value_type = type(value)
+    if value_type is str:
+        return intern(value)
+    elif value_type is tuple:
+        return tuple(_intern(v) for v in value)
+    return value
+
+
+class _Encoder(object):
+
+    def __init__(self, externals=()):
+        self._class_names = dict((v, k) for k, v in _get_classes().iteritems())
+        # Objects which are referenced but not serialized; they have to
+        # be passed to _decode() in the same order.
+        self._indexes = dict((id(obj), i) for i, obj in enumerate(externals))
+
+    def _get_state(self, obj):
+        if hasattr(obj, '__dict__'):
+            return obj.__dict__
+        return dict((name, getattr(obj, name)) for name in _get_slots(type(obj)))
+
+    def _get_children(self, obj):
+        obj_type = type(obj)
+        if obj_type in (list, set):
+            return obj
+        elif obj_type in (dict, OrderedDict):
+            for key in obj:
+                if not _is_plain(key):
+                    raise ValueError("Can not serialize dictionary key %r" % (key, ))
+            return obj.itervalues()
+        elif obj_type in self._class_names:
+            return self._get_state(obj).itervalues()
+        elif obj_type is tuple:
+            raise ValueError("Can not serialize tuples containing objects")
+        else:
+            raise ValueError("Can not serialize instances of %r" % (obj_type, ))
+
+    def _get_kind(self, obj):
+        obj_type = type(obj)
+        if obj_type is list:
+            plain = [_is_plain(item) for item in obj]
+            if all(plain):
+                return _KIND_PLAIN_LIST
+            elif not any(plain):
+                return _KIND_REF_LIST
+            return _KIND_MIXED_LIST
+        elif obj_type is dict:
+            return _KIND_DICT
+        elif obj_type is OrderedDict:
+            return _KIND_ODICT
+        elif obj_type is set:
+            return _KIND_SET
+        return self._class_names[obj_type]
+
+    def collect(self, root):
+        objects = []
+        seen = set(self._indexes)
+        stack = [root]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            objects.append(obj)
+            for child in self._get_children(obj):
+                if not _is_plain(child) and id(child) not in seen:
+                    stack.append(child)
+        return objects
+
+    def _ref(self, value):
+        if _is_plain(value):
+            return _intern(value)
+        return self._indexes[id(value)]
+
+    def encode(self, root):
+        groups = OrderedDict()
+        for obj in self.collect(root):
+            groups.setdefault(self._get_kind(obj), []).append(obj)
+
+        index = len(self._indexes)
+        for objects in groups.itervalues():
+            for obj in objects:
+                self._indexes[id(obj)] = index
+                index += 1
+
+        kinds = []
+        contents = []
+        patches = []
+        n_dicts = 0
+        for kind, objects in groups.iteritems():
+            if isinstance(kind, str):
+                kinds.append((intern(kind), len(objects)))
+                if hasattr(objects[0], '__dict__'):
+                    states = []
+                    for obj in objects:
+                        states.append(self._encode_dict(obj.__dict__, n_dicts, patches))
+                        n_dicts += 1
+                    contents.append(tuple(states))
+                else:
+                    slots = _get_slots(type(objects[0]))
+                    values = []
+                    for name in slots:
+                        column = tuple(getattr(obj, name) for obj in objects)
+                        if not _is_plain(column):
+                            raise ValueError("Can not serialize slot %r" % (name, ))
+                        values.append(_intern(column))
+                    contents.append((tuple(intern(name) for name in slots),
+                                     tuple(values)))
+                continue
+
+            kinds.append((kind, len(objects)))
+            if kind in (_KIND_PLAIN_LIST, _KIND_REF_LIST):
+                contents.append(tuple(tuple(self._ref(item) for item in obj)
+                                      for obj in objects))
+            elif kind == _KIND_MIXED_LIST:
+                contents.append(tuple((tuple(self._ref(item) for item in obj),
+                                       tuple(i for i, item in enumerate(obj)
+                                             if not _is_plain(item)))
+                                      for obj in objects))
+            elif kind == _KIND_DICT:
+                states = []
+                for obj in objects:
+                    states.append(self._encode_dict(obj, n_dicts, patches))
+                    n_dicts += 1
+                contents.append(tuple(states))
+            elif kind == _KIND_ODICT:
+                states = []
+                for obj in objects:
+                    states.append((self._encode_dict(obj, n_dicts, patches),
+                                   tuple(_intern(key) for key in obj)))
+                    n_dicts += 1
+                contents.append(tuple(states))
+            elif kind == _KIND_SET:
+                contents.append(tuple((tuple(_intern(item) for item in obj
+                                             if _is_plain(item)),
+                                       tuple(self._ref(item) for item in obj
+                                             if not _is_plain(item)))
+                                      for obj in objects))
+
+        if patches:
+            patches = tuple(zip(*patches))
+        else:
+            patches = ((), (), ())
+
+        return (FORMAT_VERSION,
+                tuple(kinds),
+                tuple(contents),
+                patches,
+                self._indexes[id(root)])
+
+    def _encode_dict(self, obj, n_dict, patches):
+        state = {}
+        for key, value in obj.iteritems():
+            key = _intern(key)
+            if _is_plain(value):
+                state[key] = _intern(value)
+            else:
+                state[key] = self._indexes[id(value)]
+                patches.append((n_dict, key, state[key]))
+        return state
+
+
+def _decode(data, externals=()):
+    (version, kinds, contents, patches, root_index) = data
+    if version != FORMAT_VERSION:
+        raise ValueError("Unsupported format version %r" % (version, ))
+
+    known_classes = _get_classes()
+    objects = list(externals)
+    dicts = []
+    deferred = []
+
+    # First create all the objects, together with their plain state
+    for (kind, count), content in zip(kinds, contents):
+        if isinstance(kind, str):
+            cls = known_classes.get(kind)
+            if cls is None:
+                raise ValueError("Unknown class %r" % (kind, ))
+            group = map(cls.__new__, repeat(cls, count))
+            if type(content) is tuple and content and type(content[0]) is dict:
+                map(object.__setattr__, group, repeat('__dict__', count), content)
+                dicts.extend(content)
+            elif content and type(content[0]) is tuple:
+                for name, values in zip(*content):
+                    map(setattr, group, repeat(name, count), values)
+        elif kind == _KIND_PLAIN_LIST:
+            group = map(list, content)
+        elif kind in (_KIND_REF_LIST, _KIND_MIXED_LIST):
+            group = map(list, repeat((), count))
+            deferred.append((kind, group, content))
+        elif kind == _KIND_DICT:
+            group = list(content)
+            dicts.extend(content)
+        elif kind == _KIND_ODICT:
+            group = map(OrderedDict.__new__, repeat(OrderedDict, count))
+            states = [state for state, keys in content]
+            dicts.extend(states)
+            deferred.append((kind, group, content))
+        elif kind == _KIND_SET:
+            group = map(set, [plain for plain, refs in content])
+            deferred.append((kind, group, content))
+        else:
+            raise ValueError("Unknown kind %r" % (kind, ))
+        objects.extend(group)
+
+    get_object = objects.__getitem__
+
+    # Resolve references from dictionaries and instance states
+    dict_indexes, keys, targets = patches
+    map(dict.__setitem__, map(dicts.__getitem__, dict_indexes), keys,
+        map(get_object, targets))
+
+    # Containers which hash their items can only be filled once
+    # the state of all the instances is complete.
+    for kind, group, content in deferred:
+        if kind == _KIND_REF_LIST:
+            map(list.extend, group, map(map, repeat(get_object, len(group)), content))
+        elif kind == _KIND_MIXED_LIST:
+            for obj, (items, refs) in zip(group, content):
+                obj.extend(items)
+                for i in refs:
+                    obj[i] = objects[obj[i]]
+        elif kind == _KIND_ODICT:
+            states, odict_keys = zip(*content)
+            map(dict.update, group, states)
+            map(setattr, group, repeat('_list', len(group)), map(list, odict_keys))
+        elif kind == _KIND_SET:
+            map(set.update, group,
+                map(map, repeat(get_object, len(group)), [refs for plain, refs in content]))
+
+    return objects[root_index]
+
+
+def _dumps_table(root, externals=()):
+    return marshal.dumps(_Encoder(externals).encode(root), _MARSHAL_VERSION)
+
+
+def _loads_table(data, externals=()):
+    try:
+        data = marshal.loads(data)
+    except (EOFError, TypeError) as e:
+        raise ValueError(str(e))
+    # The cyclic garbage collector would otherwise run several times
+    # while all the objects are created, without finding anything.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _decode(data, externals)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def dumps_namespace(namespace):
+    """Serialize namespace, raises ValueError if the graph contains
+objects which can not be represented."""
+    assert isinstance(namespace, ast.Namespace)
+    return MAGIC + _dumps_table(namespace)
+
+
+def loads_namespace(data):
+    """Load a namespace from data as returned by dumps_namespace(),
+raises ValueError if data is not a valid serialized namespace."""
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a serialized namespace")
+    return _loads_table(data[len(MAGIC):])
+
+
+# Work done by LazyNamespace instances, see CacheStatistics
+lazy_statistics = {'chunks': 0, 'bytes': 0, 'time': 0.0}
+
+# Tables of a namespace which are split up between the chunks of the
+# indexed format, and which LazyNamespace fills in on demand.
+_LAZY_TABLES = ('names', 'aliases', 'type_names', 'ctypes', 'symbols')
+
+
+class LazyNamespace(ast.Namespace):
+    """A namespace loaded from the indexed format.  The nodes are
+only created once they are looked up through get(), get_by_ctype(),
+get_by_symbol() or get_by_gtype_name(); any other access to the
+tables loads all of them."""
+
+    def __init__(self, buf, offset, header):
+        (version, shell, name_order, chunks, index) = header
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported format version %r" % (version, ))
+        shell = _loads_table(shell)
+        self.__dict__.update(shell.__dict__)
+        self._buf = buf
+        self._offset = offset
+        self._name_order = name_order
+        self._chunks = chunks
+        self._loaded = [False] * len(chunks)
+        self._index = index
+        self._complete = False
+        self._names = {}
+        self._aliases = {}
+        self._type_names = {}
+        self._ctypes = {}
+        self._symbols = {}
+
+    def _load_chunk(self, chunk):
+        if self._loaded[chunk]:
+            return
+        self._loaded[chunk] = True
+        start, length = self._chunks[chunk]
+        start += self._offset
+        load_start = time.time()
+        tables = _loads_table(self._buf[start:start + length], [self])
+        lazy_statistics['chunks'] += 1
+        lazy_statistics['bytes'] += length
+        lazy_statistics['time'] += time.time() - load_start
+        for name, table in tables.iteritems():
+            getattr(self, '_' + name).update(table)
+
+    def _load_entry(self, table, key):
+        if not self._complete:
+            chunk = self._index[table].get(key)
+            if chunk is not None:
+                self._load_chunk(chunk)
+
+    def _load_all(self):
+        if self._complete:
+            return
+        for chunk in xrange(len(self._chunks)):
+            self._load_chunk(chunk)
+        self._names = OrderedDict((name, self._names[name]) for name in self._name_order)
+        self._complete = True
+        self._buf = None
+
+    @property
+    def names(self):
+        self._load_all()
+        return self._names
+
+    @property
+    def aliases(self):
+        self._load_all()
+        return self._aliases
+
+    @property
+    def type_names(self):
+        self._load_all()
+        return self._type_names
+
+    @property
+    def ctypes(self):
+        self._load_all()
+        return self._ctypes
+
+    @property
+    def symbols(self):
+        self._load_all()
+        return self._symbols
+
+    def __iter__(self):
+        if self._complete:
+            return iter(self._names)
+        return iter(self._name_order)
+
+    def __contains__(self, name):
+        if self._complete:
+            return name in self._names
+        return name in self._index['names']
+
+    def get(self, name):
+        self._load_entry('names', name)
+        return self._names.get(name)
+
+    def get_by_ctype(self, ctype):
+        self._load_entry('ctypes', ctype)
+        return self._ctypes.get(ctype)
+
+    def get_by_symbol(self, symbol):
+        self._load_entry('symbols', symbol)
+        return self._symbols.get(symbol)
+
+    def get_by_gtype_name(self, gtype_name):
+        self._load_entry('type_names', gtype_name)
+        return self._type_names.get(gtype_name)
+
+
+def dumps_indexed_namespace(namespace):
+    """Serialize namespace in the indexed format, where every node in
+namespace.names is stored in a chunk of its own.  Raises ValueError if
+the graph contains objects which can not be represented or objects
+which are shared between nodes."""
+    assert isinstance(namespace, ast.Namespace)
+    externals = [namespace]
+    roots = []
+    owners = {}
+    for chunk, (name, node) in enumerate(namespace.names.iteritems()):
+        for obj in _Encoder(externals).collect(node):
+            owner = owners.setdefault(id(obj), chunk)
+            # Type instances such as ast.TYPE_ANY are shared, but
+            # they are plain values which can be copied freely.
+            if owner != chunk and not isinstance(obj, ast.Type):
+                raise ValueError("%r is shared between %r and %r" % (
+                    obj, namespace.names.keys()[owner], name))
+        roots.append({'names': {name: node}})
+
+    index = {}
+    for table in _LAZY_TABLES:
+        index[table] = table_index = {}
+        for key, node in getattr(namespace, table).iteritems():
+            chunk = owners.get(id(node))
+            if chunk is None:
+                # Nodes which are not in names, like floated functions
+                if len(roots) == len(namespace.names):
+                    roots.append({})
+                chunk = len(roots) - 1
+            roots[chunk].setdefault(table, {})[key] = node
+            table_index[_intern(key)] = chunk
+
+    chunks = []
+    offset = 0
+    for root in roots:
+        data = _dumps_table(root, externals)
+        chunks.append((data, offset, len(data)))
+        offset += len(data)
+
+    shell = copy.copy(namespace)
+    for table in _LAZY_TABLES:
+        delattr(shell, table)
+    header = (FORMAT_VERSION,
+              _dumps_table(shell),
+              tuple(_intern(name) for name in namespace.names),
+              tuple((offset, length) for data, offset, length in chunks),
+              index)
+    header = marshal.dumps(header, _MARSHAL_VERSION)
+    return ''.join([INDEXED_MAGIC, struct.pack('<I', len(header)), header] +
+                   [data for data, offset, length in chunks])
+
+
+def load_indexed_namespace(buf, offset=0):
+    """Load a LazyNamespace from buf, which can be a string or a
+mmap object containing data as returned by dumps_indexed_namespace()
+at offset.  The buffer is used until all nodes of the namespace have
+been loaded.  Raises ValueError if buf is not a valid serialized
+namespace."""
+    start = offset + len(INDEXED_MAGIC)
+    if buf[offset:start] != INDEXED_MAGIC:
+        raise ValueError("Not an indexed namespace")
+    size = struct.calcsize('<I')
+    if len(buf) < start + size:
+        raise ValueError("Truncated indexed namespace")
+    length, = struct.unpack('<I', buf[start:start + size])
+    start += size
+    try:
+        header = marshal.loads(buf[start:start + length])
+    except (EOFError, TypeError) as e:
+        raise ValueError(str(e))
+    return LazyNamespace(buf, start + length, header)
@@ -18,37 +18,236 @@
 # Boston, MA 02111-1307, USA.
 #
 
+import atexit
 import errno
 import cPickle
-import glob
 import hashlib
+import json
+import mmap
 import os
-import shutil
 import sys
 import tempfile
+import time
 
-import giscanner
-
+from . import ast
+from . import cacheformat
 from . import utils
 
 
-_CACHE_VERSION_FILENAME = '.cache-version'
+# Version of the data stored in the cache entries.  It has to be bumped
+# whenever the objects written by CacheStore.store() change in an
+# incompatible way, that is when ast.py or girparser.py change what is
+# stored in the nodes.  Every entry starts with a header containing it,
+# and it is part of the cache keys so that entries written by different
+# versions of the scanner can coexist.
+_CACHE_SCHEMA_VERSION = '4'
+
+# Default limits for the cache directory, they can be changed with
+# GI_SCANNER_CACHE_MAX_SIZE and GI_SCANNER_CACHE_MAX_ENTRIES.
+_CACHE_MAX_SIZE = 256 * 1024 * 1024
+_CACHE_MAX_ENTRIES = 4096
+
+# Once a limit is exceeded, entries are evicted until the cache is
+# below this fraction of it, so that not every store has to prune.
+_CACHE_PRUNE_RATIO = 0.9
+
+# Name of the read-only cache directories next to installed GIR files,
+# which are generated with g-ir-scanner --generate-system-cache
+_SYSTEM_CACHE_DIRNAME = 'g-ir-scanner-cache'
+
+# Seconds after which the lock of a cache entry is considered stale,
+# which happens when a scanner got killed while parsing.
+_LOCK_TIMEOUT = 60
+_LOCK_POLL_INTERVAL = 0.05
+
+_SIZE_SUFFIXES = {'k': 1024,
+                  'm': 1024 * 1024,
+                  'g': 1024 * 1024 * 1024}
+
+
+def _get_entry_header():
+    # marshal and pickle data is not necessarily portable between
+    # Python versions, so the Python version is part of the schema.
+    return 'g-ir-scanner cache %s.%d python%d.%d\n' % (
+        _CACHE_SCHEMA_VERSION, cacheformat.FORMAT_VERSION,
+        sys.version_info[0], sys.version_info[1])
+
+
+def _get_system_cachedir(filename):
+    return os.path.join(os.path.dirname(os.path.abspath(filename)),
+                        _SYSTEM_CACHE_DIRNAME)
+
+
+def _rename(src, dst):
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # Windows does not allow renaming over an existing file
+        if os.name != 'nt' or not os.path.exists(dst):
+            raise
+        os.unlink(dst)
+        os.rename(src, dst)
+
+
+def _get_limit(name, default):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    multiplier = _SIZE_SUFFIXES.get(value[-1].lower())
+    if multiplier is not None:
+        value = value[:-1]
+    else:
+        multiplier = 1
+    try:
+        limit = int(value) * multiplier
+    except ValueError:
+        limit = -1
+    if limit < 0:
+        sys.stderr.write("Invalid value for %s: %r, using %d\n" % (
+            name, os.environ[name], default))
+        return default
+    return limit
+
+
+def _get_content_digest(filename):
+    digest = hashlib.sha1(_get_entry_header())
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(65536)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _dumps(data):
+    # Namespaces are by far the most common entries and are stored in
+    # the indexed format, so that loading them only touches the nodes
+    # which are looked up later on.  The compact format is used if the
+    # namespace can not be split up into independent nodes.
+    if isinstance(data, ast.Namespace):
+        for dumps in (cacheformat.dumps_indexed_namespace,
+                      cacheformat.dumps_namespace):
+            try:
+                return dumps(data)
+            except ValueError:
+                pass
+    return cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
+
+
+def _load(fd, offset):
+    magic = fd.read(len(cacheformat.INDEXED_MAGIC))
+    if magic == cacheformat.INDEXED_MAGIC:
+        try:
+            buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except EnvironmentError:
+            buf = magic + fd.read()
+            offset = 0
+        return cacheformat.load_indexed_namespace(buf, offset)
+    data = magic + fd.read()
+    if data.startswith(cacheformat.MAGIC):
+        return cacheformat.loads_namespace(data)
+    return cPickle.loads(data)
+
+
+class CacheStatistics(object):
+    """Counters for the cache usage of this process, they are reported
+at exit with GI_SCANNER_DEBUG=cache and written to the file named by
+GI_SCANNER_CACHE_STATS as one line of JSON."""
+
+    MISS_REASONS = ('missing', 'stale', 'version', 'broken', 'disabled')
+
+    def __init__(self):
+        self.hits = {'system': 0, 'user': 0}
+        self.misses = dict((reason, 0) for reason in self.MISS_REASONS)
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.load_time = 0.0
+        self.store_time = 0.0
+        self.lock_waits = 0
+        self.lock_wait_time = 0.0
+
+    def as_dict(self):
+        lazy = cacheformat.lazy_statistics
+        return {'hits': dict(self.hits),
+                'misses': dict(self.misses),
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written,
+                'load_time': self.load_time,
+                'store_time': self.store_time,
+                'lock_waits': self.lock_waits,
+                'lock_wait_time': self.lock_wait_time,
+                'lazy_chunks': lazy['chunks'],
+                'lazy_bytes': lazy['bytes'],
+                'lazy_time': lazy['time']}
+
+    def format(self):
+        stats = self.as_dict()
+        lines = ['g-ir-scanner cache statistics:',
+                 '  hits: %d (system %d, user %d)' % (
+                     sum(self.hits.values()), self.hits['system'], self.hits['user']),
+                 '  misses: %d (%s)' % (
+                     sum(self.misses.values()),
+                     ', '.join('%s %d' % (reason, self.misses[reason])
+                               for reason in self.MISS_REASONS)),
+                 '  read: %(bytes_read)d bytes in %(load_time).3fs' % stats,
+                 '  written: %(bytes_written)d bytes in %(store_time).3fs' % stats,
+                 '  lazily loaded: %(lazy_chunks)d nodes, %(lazy_bytes)d bytes '
+                 'in %(lazy_time).3fs' % stats,
+                 '  waited for other processes: %(lock_waits)d times, '
+                 '%(lock_wait_time).3fs' % stats]
+        return '\n'.join(lines) + '\n'
 
 
-def _get_versionhash():
-    toplevel = os.path.dirname(giscanner.__file__)
-    sources = glob.glob(os.path.join(toplevel, '*.py'))
-    sources.append(sys.argv[0])
-    # Using mtimes is a bit (5x) faster than hashing the file contents
-    mtimes = (str(os.stat(source).st_mtime) for source in sources)
-    return hashlib.sha1(''.join(mtimes)).hexdigest()
+statistics = CacheStatistics()
+_report_registered = False
+
+# Estimated [size, number of entries] of the cache directories, as
+# found by the last prune() of this process plus what it stored since.
+_usage = {}
+
+
+def _report_statistics():
+    if utils.have_debug_flag('cache'):
+        sys.stderr.write(statistics.format())
+    filename = os.environ.get('GI_SCANNER_CACHE_STATS')
+    if filename:
+        stats = statistics.as_dict()
+        stats['pid'] = os.getpid()
+        stats['time'] = time.time()
+        try:
+            # A single write in append mode, so that concurrent
+            # processes don't mix up their lines.
+            with open(filename, 'a') as f:
+                f.write(json.dumps(stats, sort_keys=True) + '\n')
+        except IOError as e:
+            sys.stderr.write("Failed to write cache statistics to %s: %s\n" % (
+                filename, e.strerror))
+
+
+def _register_report():
+    global _report_registered
+    if _report_registered:
+        return
+    _report_registered = True
+    if utils.have_debug_flag('cache') or os.environ.get('GI_SCANNER_CACHE_STATS'):
+        atexit.register(_report_statistics)
 
 
 class CacheStore(object):
 
     def __init__(self):
         self._directory = self._get_cachedir()
-        self._check_cache_version()
+        # When enabled, entries are keyed on the contents of the cached
+        # file instead of its path, so identical files reached through
+        # different paths (build trees, prefixes, containers) share the
+        # same entry and mtimes are irrelevant for freshness.
+        self._content_addressed = 'GI_SCANNER_CACHE_BY_CONTENT' in os.environ
+        self._content_digests = {}
+        # A limit of 0 disables it
+        self._max_size = _get_limit('GI_SCANNER_CACHE_MAX_SIZE', _CACHE_MAX_SIZE)
+        self._max_entries = _get_limit('GI_SCANNER_CACHE_MAX_ENTRIES', _CACHE_MAX_ENTRIES)
+        _register_report()
 
     def _get_cachedir(self):
         if 'GI_SCANNER_DISABLE_CACHE' in os.environ:
@@ -57,123 +256,368 @@ class CacheStore(object):
             cachedir = utils.get_user_cache_dir('g-ir-scanner')
             return cachedir
 
-    def _check_cache_version(self):
+    def _get_key(self, filename, name, variant, content_addressed):
+        if content_addressed:
+            key = self._content_digests.get(filename)
+            if key is None:
+                key = _get_content_digest(filename)
+                self._content_digests[filename] = key
+        else:
+            key = hashlib.sha1(_get_entry_header() + name).hexdigest()
+        # Different kinds of data for the same file, like the
+        # namespaces parsed in types only and in full mode, are
+        # stored as variants of the same key.
+        if variant is not None:
+            key = '%s-%s' % (key, variant)
+        return key
+
+    def _get_filename(self, filename, variant=None):
+        # If we couldn't create the directory we're probably
+        # on a read only home directory where we just disable
+        # the cache all together.
         if self._directory is None:
             return
+        return os.path.join(self._directory,
+                            self._get_key(filename, filename, variant,
+                                          self._content_addressed))
 
-        current_hash = _get_versionhash()
-        version = os.path.join(self._directory, _CACHE_VERSION_FILENAME)
-        try:
-            with open(version, 'r') as version_file:
-                cache_hash = version_file.read()
-        except IOError as e:
-            # File does not exist
-            if e.errno == errno.ENOENT:
-                cache_hash = 0
-            else:
-                raise
-
-        if current_hash == cache_hash:
-            return
+    def _get_system_filename(self, filename, variant=None):
+        # The system cache lives next to the GIR files, so only their
+        # names are part of the keys; that keeps the entries valid
+        # when the files are reached through another prefix.  It is
+        # built once for all users, so their GI_SCANNER_CACHE_BY_CONTENT
+        # setting does not change the keys.
+        return os.path.join(_get_system_cachedir(filename),
+                            self._get_key(filename, os.path.basename(filename), variant,
+                                          False))
 
-        self._clean()
+    def _cache_is_valid(self, store_filename, filename, content_addressed):
+        if content_addressed:
+            # The key already changes with the content
+            return True
+        if filename is None:
+            # Not derived from a single file, see load_data()
+            return True
+        return (os.stat(store_filename).st_mtime >=
+                os.stat(filename).st_mtime)
 
-        tmp_fd, tmp_filename = tempfile.mkstemp(prefix='g-ir-scanner-cache-version-')
+    def _mark_used(self, store_filename):
+        # The access time is what prune() evicts by, set it explicitly
+        # as file systems are often mounted with noatime or relatime.
+        # The modification time is kept for _cache_is_valid().
         try:
-            with os.fdopen(tmp_fd, 'w') as tmp_file:
-                tmp_file.write(current_hash)
+            st = os.stat(store_filename)
+            os.utime(store_filename, (time.time(), st.st_mtime))
+        except OSError:
+            pass
 
-            # On Unix, this would just be os.rename() but Windows
-            # doesn't allow that.
-            shutil.move(tmp_filename, version)
-        except IOError as e:
-            # Permission denied
-            if e.errno == errno.EACCES:
-                return
-            else:
+    def _get_entries(self):
+        entries = []
+        now = time.time()
+        for filename in os.listdir(self._directory):
+            path = os.path.join(self._directory, filename)
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                # Removed in the meantime
+                if e.errno == errno.ENOENT:
+                    continue
                 raise
+            if filename.startswith('.'):
+                # Temporary files and locks left behind by killed
+                # processes.
+                if now - st.st_mtime > _LOCK_TIMEOUT:
+                    self._remove_filename(path)
+                continue
+            entries.append((st.st_atime, st.st_size, path))
+        return entries
 
-    def _get_filename(self, filename):
-        # If we couldn't create the directory we're probably
-        # on a read only home directory where we just disable
-        # the cache all together.
+    def _is_over_limit(self, size, n_entries, ratio=1.0):
+        return ((self._max_size and size > self._max_size * ratio) or
+                (self._max_entries and n_entries > self._max_entries * ratio))
+
+    def prune(self):
+        """Evict the least recently used entries if the cache exceeds
+its size or entry limit.  Returns the number of removed entries."""
         if self._directory is None:
-            return
-        hexdigest = hashlib.sha1(filename).hexdigest()
-        return os.path.join(self._directory, hexdigest)
+            return 0
 
-    def _cache_is_valid(self, store_filename, filename):
-        return (os.stat(store_filename).st_mtime >=
-                os.stat(filename).st_mtime)
+        entries = self._get_entries()
+        size = sum(entry_size for atime, entry_size, path in entries)
+        n_entries = len(entries)
+        if not self._is_over_limit(size, n_entries):
+            _usage[self._directory] = [size, n_entries]
+            return 0
+
+        entries.sort()
+        removed = 0
+        for atime, entry_size, path in entries:
+            if not self._is_over_limit(size, n_entries, _CACHE_PRUNE_RATIO):
+                break
+            if not self._remove_filename(path):
+                continue
+            size -= entry_size
+            n_entries -= 1
+            removed += 1
+        _usage[self._directory] = [size, n_entries]
+        return removed
+
+    def _maybe_prune(self, written):
+        # Listing the cache directory on every store gets slow as it
+        # grows, so it is only pruned once what this process stored
+        # since the last listing may have put it over a limit.  Entries
+        # replaced in place are counted again, which at worst prunes
+        # early.
+        usage = _usage.get(self._directory)
+        if usage is None:
+            self.prune()
+            return
+        usage[0] += written
+        usage[1] += 1
+        if self._is_over_limit(usage[0], usage[1]):
+            self.prune()
 
     def _remove_filename(self, filename):
         try:
             os.unlink(filename)
-        except IOError as e:
-            # Permission denied
-            if e.errno == errno.EACCES:
-                return
-            else:
-                raise
-        except OSError as e:
-            # File does not exist
-            if e.errno == errno.ENOENT:
-                return
+        except EnvironmentError as e:
+            # File does not exist, or permission denied which is also
+            # what Windows reports for entries that are still mapped by
+            # a LazyNamespace.
+            if e.errno in (errno.ENOENT, errno.EACCES):
+                return False
             else:
                 raise
+        return True
 
-    def _clean(self):
-        for filename in os.listdir(self._directory):
-            if filename == _CACHE_VERSION_FILENAME:
-                continue
-            self._remove_filename(os.path.join(self._directory, filename))
+    def _write_entry(self, store_filename, data):
+        # The entry is written next to its final location and renamed
+        # into place, so that other processes never see partial data.
+        tmp_fd, tmp_filename = tempfile.mkstemp(prefix='.tmp-',
+                                                dir=os.path.dirname(store_filename))
+        try:
+            with os.fdopen(tmp_fd, 'wb') as tmp_file:
+                data = _get_entry_header() + _dumps(data)
+                tmp_file.write(data)
+            os.chmod(tmp_filename, 0o644)
+            _rename(tmp_filename, store_filename)
+        except:
+            self._remove_filename(tmp_filename)
+            raise
+        return len(data)
 
-    def store(self, filename, data):
-        store_filename = self._get_filename(filename)
+    def store(self, filename, data, variant=None):
+        store_filename = self._get_filename(filename, variant)
         if store_filename is None:
             return
 
-        if (os.path.exists(store_filename) and self._cache_is_valid(store_filename, filename)):
+        if (os.path.exists(store_filename) and
+                self._cache_is_valid(store_filename, filename, self._content_addressed)):
             return None
 
-        tmp_fd, tmp_filename = tempfile.mkstemp(prefix='g-ir-scanner-cache-')
         try:
-            with os.fdopen(tmp_fd, 'w') as tmp_file:
-                cPickle.dump(data, tmp_file)
-        except IOError as e:
-            # No space left on device
-            if e.errno == errno.ENOSPC:
-                self._remove_filename(tmp_filename)
+            start = time.time()
+            written = self._write_entry(store_filename, data)
+            statistics.bytes_written += written
+            statistics.store_time += time.time() - start
+        except EnvironmentError as e:
+            # No space left on device or permission denied
+            if e.errno in (errno.ENOSPC, errno.EACCES):
                 return
             else:
                 raise
 
+        self._maybe_prune(written)
+
+    def _get_lock_filename(self, store_filename):
+        directory, key = os.path.split(store_filename)
+        return os.path.join(directory, '.%s.lock' % (key, ))
+
+    def _lock(self, store_filename):
+        """Wait until the lock for store_filename is taken.  Returns
+False if the lock can not be created at all."""
+        lock_filename = self._get_lock_filename(store_filename)
+        start = time.time()
+        waited = False
         try:
-            shutil.move(tmp_filename, store_filename)
-        except IOError as e:
-            # Permission denied
-            if e.errno == errno.EACCES:
-                self._remove_filename(tmp_filename)
+            while True:
+                try:
+                    fd = os.open(lock_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        return False
+                else:
+                    os.write(fd, str(os.getpid()))
+                    os.close(fd)
+                    return True
+
+                try:
+                    age = time.time() - os.stat(lock_filename).st_mtime
+                except OSError:
+                    # Released in the meantime
+                    continue
+                if age > _LOCK_TIMEOUT:
+                    # The owner is gone, take over
+                    self._remove_filename(lock_filename)
+                    continue
+                waited = True
+                time.sleep(_LOCK_POLL_INTERVAL)
+        finally:
+            if waited:
+                statistics.lock_waits += 1
+                statistics.lock_wait_time += time.time() - start
+
+    def _unlock(self, store_filename):
+        self._remove_filename(self._get_lock_filename(store_filename))
+
+    def load_or_create(self, filename, create, variant=None):
+        """Load the data for filename or create it with create(filename)
+and store it.  Only one process at a time creates the entry for a
+given file, the others wait for it and load the stored entry."""
+        data = self.load(filename, variant)
+        if data is not None:
+            return data
+
+        store_filename = self._get_filename(filename, variant)
+        if store_filename is None:
+            return create(filename)
+
+        locked = self._lock(store_filename)
+        try:
+            # Another process might have stored it while we waited
+            data = self.load(filename, variant)
+            if data is None:
+                data = create(filename)
+                self.store(filename, data, variant)
+        finally:
+            if locked:
+                self._unlock(store_filename)
+        return data
+
+    def _get_data_filename(self, name):
+        if self._directory is None:
+            return
+        return os.path.join(self._directory,
+                            hashlib.sha1(_get_entry_header() + name).hexdigest())
+
+    def store_data(self, name, data):
+        """Store data which is not derived from a single file under the
+key name, replacing any previous entry."""
+        store_filename = self._get_data_filename(name)
+        if store_filename is None:
+            return
+
+        try:
+            start = time.time()
+            written = self._write_entry(store_filename, data)
+            statistics.bytes_written += written
+            statistics.store_time += time.time() - start
+        except EnvironmentError as e:
+            if e.errno in (errno.ENOSPC, errno.EACCES):
+                return
             else:
                 raise
 
-    def load(self, filename):
-        store_filename = self._get_filename(filename)
+        self._maybe_prune(written)
+
+    def load_data(self, name):
+        """Load the data stored with store_data(), checking that it is
+still valid is up to the caller."""
+        store_filename = self._get_data_filename(name)
         if store_filename is None:
+            statistics.misses['disabled'] += 1
+            return None
+        data, reason = self._load_filename(store_filename, None)
+        # Stored data can be None as well
+        if reason is not None:
+            statistics.misses[reason] += 1
+        else:
+            statistics.hits['user'] += 1
+        return data
+
+    def store_system(self, filename, data, variant=None):
+        """Store data in the read-only system cache next to filename,
+which is meant to be done when the GIR file gets installed."""
+        directory = _get_system_cachedir(filename)
+        try:
+            os.mkdir(directory, 0o755)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        store_filename = self._get_system_filename(filename, variant)
+        self._write_entry(store_filename, data)
+        return store_filename
+
+    def clean_system(self, directory, filenames):
+        """Remove the entries from the system cache in directory which
+do not belong to any of filenames."""
+        cachedir = os.path.join(directory, _SYSTEM_CACHE_DIRNAME)
+        if not os.path.isdir(cachedir):
             return
+        keep = set(os.path.basename(self._get_system_filename(filename))
+                   for filename in filenames)
+        for entry in os.listdir(cachedir):
+            # Keep all the variants of the entries
+            if entry.split('-', 1)[0] not in keep:
+                self._remove_filename(os.path.join(cachedir, entry))
+
+    def _load_filename(self, store_filename, filename, read_only=False):
+        """Returns a tuple of the loaded data, or None, and the reason
+why nothing was loaded."""
         try:
-            fd = open(store_filename)
+            fd = open(store_filename, 'rb')
         except IOError as e:
-            if e.errno == errno.ENOENT:
-                return None
+            if e.errno in (errno.ENOENT, errno.ENOTDIR) or read_only:
+                return None, 'missing'
             else:
                 raise
-        if not self._cache_is_valid(store_filename, filename):
+        with fd:
+            # Only the system cache is read only, and it is never
+            # content addressed
+            content_addressed = self._content_addressed and not read_only
+            if not self._cache_is_valid(store_filename, filename, content_addressed):
+                return None, 'stale'
+            start = time.time()
+            header = _get_entry_header()
+            if fd.readline(len(header)) != header:
+                reason = 'version'
+            else:
+                try:
+                    data = _load(fd, len(header))
+                except (AttributeError, EOFError, ValueError, cPickle.BadPickleGet,
+                        cPickle.UnpicklingError):
+                    reason = 'broken'
+                else:
+                    reason = None
+            if reason is not None:
+                # Unusable cache entry, remove it unless it is in the
+                # system cache which is not ours to change.
+                if not read_only:
+                    self._remove_filename(store_filename)
+                return None, reason
+            statistics.load_time += time.time() - start
+            statistics.bytes_read += os.fstat(fd.fileno()).st_size
+        if not read_only:
+            self._mark_used(store_filename)
+        return data, None
+
+    def load(self, filename, variant=None):
+        # The system cache is consulted first, even if the user cache
+        # is disabled, as it is never written to by a scan.
+        data, reason = self._load_filename(self._get_system_filename(filename, variant),
+                                           filename, read_only=True)
+        if reason is None:
+            statistics.hits['system'] += 1
+            return data
+
+        store_filename = self._get_filename(filename, variant)
+        if store_filename is None:
+            statistics.misses['disabled'] += 1
             return None
-        try:
-            data = cPickle.load(fd)
-        except (AttributeError, EOFError, ValueError, cPickle.BadPickleGet):
-            # Broken cache entry, remove it
-            self._remove_filename(store_filename)
-            data = None
+        data, reason = self._load_filename(store_filename, filename)
+        if reason is not None:
+            statistics.misses[reason] += 1
+        else:
+            statistics.hits['user'] += 1
         return data
@@ -24,6 +24,8 @@ import subprocess
 import sys
 import distutils
 
+from distutils.ccompiler import gen_preprocess_options
+from distutils.errors import CompileError
 from distutils.msvccompiler import MSVCCompiler
 from distutils.unixccompiler import UnixCCompiler
 from distutils.cygwinccompiler import Mingw32CCompiler
@@ -172,23 +174,7 @@ class CCompiler(object):
                     args.append('-l' + library)
 
     def preprocess(self, source, output, cpp_options):
-        extra_postargs = ['-C']
-        (include_paths, macros, postargs) = self._set_cpp_options(cpp_options)
-
-        # We always want to include the current path
-        include_dirs = ['.']
-
-        include_dirs.extend(include_paths)
-        extra_postargs.extend(postargs)
-
-        # Define these macros when using Visual C++ to silence many warnings,
-        # and prevent stepping on many Visual Studio-specific items, so that
-        # we don't have to handle them specifically in scannerlexer.l
-        if self.check_is_msvc():
-            macros.append(('_USE_DECLSPECS_FOR_SAL', None))
-            macros.append(('_CRT_SECURE_NO_WARNINGS', None))
-            macros.append(('_CRT_NONSTDC_NO_WARNINGS', None))
-            macros.append(('SAL_NO_ATTRIBUTE_DECLARATIONS', None))
+        (include_dirs, macros, extra_postargs) = self._get_preprocess_args(cpp_options)
 
         self.compiler.preprocess(source=source,
                                  output_file=output,
@@ -196,6 +182,24 @@ class CCompiler(object):
                                  include_dirs=include_dirs,
                                  extra_postargs=extra_postargs)
 
+    def check_can_preprocess_to_pipe(self):
+        return not self.check_is_msvc() and bool(self.compiler.preprocessor)
+
+    def preprocess_to_pipe(self, source, cpp_options):
+        """Start the preprocessor on source and return its subprocess.Popen
+        instance, the preprocessed output can be read from its stdout."""
+        (include_dirs, macros, extra_postargs) = self._get_preprocess_args(cpp_options)
+
+        cpp_args = list(self.compiler.preprocessor)
+        cpp_args.extend(gen_preprocess_options(macros, include_dirs))
+        cpp_args.extend(extra_postargs)
+        cpp_args.append(source)
+
+        try:
+            return subprocess.Popen(cpp_args, stdout=subprocess.PIPE)
+        except OSError as e:
+            raise CompileError("command '%s' failed: %s" % (cpp_args[0], e))
+
     def compile(self, pkg_config_cflags, cpp_includes, source, init_sections):
         extra_postargs = []
         includes = []
@@ -347,6 +351,27 @@ class CCompiler(object):
             return False
 
     # Private APIs
+    def _get_preprocess_args(self, cpp_options):
+        extra_postargs = ['-C']
+        (include_paths, macros, postargs) = self._set_cpp_options(cpp_options)
+
+        # We always want to include the current path
+        include_dirs = ['.']
+
+        include_dirs.extend(include_paths)
+        extra_postargs.extend(postargs)
+
+        # Define these macros when using Visual C++ to silence many warnings,
+        # and prevent stepping on many Visual Studio-specific items, so that
+        # we don't have to handle them specifically in scannerlexer.l
+        if self.check_is_msvc():
+            macros.append(('_USE_DECLSPECS_FOR_SAL', None))
+            macros.append(('_CRT_SECURE_NO_WARNINGS', None))
+            macros.append(('_CRT_NONSTDC_NO_WARNINGS', None))
+            macros.append(('SAL_NO_ATTRIBUTE_DECLARATIONS', None))
+
+        return (include_dirs, macros, extra_postargs)
+
     def _set_cpp_options(self, options):
         includes = []
         macros = []
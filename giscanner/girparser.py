@@ -20,7 +20,7 @@
 
 import os
 
-from xml.etree.cElementTree import parse
+from xml.etree.cElementTree import iterparse, parse
 
 from . import ast
 from .girwriter import COMPATIBLE_GIR_VERSION
@@ -59,12 +59,29 @@ class GIRParser(object):
         self.parse_tree(tree)
         self._filename_stack.pop()
 
+    def parse_header(self, filename):
+        """Only parse the elements preceding the namespace of filename,
+get_namespace() then returns a namespace with its prefixes and includes
+but without any node."""
+        filename = os.path.abspath(filename)
+        self._filename_stack.append(filename)
+        self._reset()
+        root = None
+        children = []
+        with open(filename) as f:
+            for event, node in iterparse(f, events=('start', )):
+                if root is None:
+                    root = node
+                elif node.tag == _corens('namespace'):
+                    self._parse_header(root, children, node)
+                    break
+                else:
+                    children.append(node)
+        assert self._namespace is not None
+        self._filename_stack.pop()
+
     def parse_tree(self, tree):
-        self._namespace = None
-        self._pkgconfig_packages = set()
-        self._includes = set()
-        self._c_includes = set()
-        self._c_prefix = None
+        self._reset()
         self._parse_api(tree.getroot())
 
     def get_namespace(self):
@@ -72,6 +89,13 @@ class GIRParser(object):
 
     # Private
 
+    def _reset(self):
+        self._namespace = None
+        self._pkgconfig_packages = set()
+        self._includes = set()
+        self._c_includes = set()
+        self._c_prefix = None
+
     def _find_first_child(self, node, name_or_names):
         if isinstance(name_or_names, str):
             for child in node.getchildren():
@@ -96,13 +120,38 @@ class GIRParser(object):
         return curfile
 
     def _parse_api(self, root):
+        ns = root.find(_corens('namespace'))
+        assert ns is not None
+        self._parse_header(root, root.getchildren(), ns)
+
+        parser_methods = {
+            _corens('alias'): self._parse_alias,
+            _corens('bitfield'): self._parse_enumeration_bitfield,
+            _corens('callback'): self._parse_callback,
+            _corens('class'): self._parse_object_interface,
+            _corens('enumeration'): self._parse_enumeration_bitfield,
+            _corens('interface'): self._parse_object_interface,
+            _corens('record'): self._parse_record,
+            _corens('union'): self._parse_union,
+            _glibns('boxed'): self._parse_boxed}
+
+        if not self._types_only:
+            parser_methods[_corens('constant')] = self._parse_constant
+            parser_methods[_corens('function')] = self._parse_function
+
+        for node in ns.getchildren():
+            method = parser_methods.get(node.tag)
+            if method is not None:
+                method(node)
+
+    def _parse_header(self, root, children, ns):
         assert root.tag == _corens('repository')
         version = root.attrib['version']
         if version != COMPATIBLE_GIR_VERSION:
             raise SystemExit("%s: Incompatible version %s (supported: %s)" %
                              (self._get_current_file(), version, COMPATIBLE_GIR_VERSION))
 
-        for node in root.getchildren():
+        for node in children:
             if node.tag == _corens('include'):
                 self._parse_include(node)
             elif node.tag == _corens('package'):
@@ -110,8 +159,6 @@ class GIRParser(object):
             elif node.tag == _cns('include'):
                 self._parse_c_include(node)
 
-        ns = root.find(_corens('namespace'))
-        assert ns is not None
         identifier_prefixes = ns.attrib.get(_cns('identifier-prefixes'))
         if identifier_prefixes:
             identifier_prefixes = identifier_prefixes.split(',')
@@ -128,26 +175,6 @@ class GIRParser(object):
         self._namespace.c_includes = self._c_includes
         self._namespace.exported_packages = self._pkgconfig_packages
 
-        parser_methods = {
-            _corens('alias'): self._parse_alias,
-            _corens('bitfield'): self._parse_enumeration_bitfield,
-            _corens('callback'): self._parse_callback,
-            _corens('class'): self._parse_object_interface,
-            _corens('enumeration'): self._parse_enumeration_bitfield,
-            _corens('interface'): self._parse_object_interface,
-            _corens('record'): self._parse_record,
-            _corens('union'): self._parse_union,
-            _glibns('boxed'): self._parse_boxed}
-
-        if not self._types_only:
-            parser_methods[_corens('constant')] = self._parse_constant
-            parser_methods[_corens('function')] = self._parse_function
-
-        for node in ns.getchildren():
-            method = parser_methods.get(node.tag)
-            if method is not None:
-                method(node)
-
     def _parse_include(self, node):
         include = ast.Include(node.attrib['name'], node.attrib['version'])
         self._includes.add(include)
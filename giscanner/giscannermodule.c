@@ -87,7 +87,7 @@ typedef struct {
 
 NEW_CLASS (PyGISourceSymbol, "SourceSymbol", GISourceSymbol, 10);
 NEW_CLASS (PyGISourceType, "SourceType", GISourceType, 9);
-NEW_CLASS (PyGISourceScanner, "SourceScanner", GISourceScanner, 8);
+NEW_CLASS (PyGISourceScanner, "SourceScanner", GISourceScanner, 17);
 
 
 /* Symbol */
@@ -152,31 +152,55 @@ symbol_get_base_type (PyGISourceSymbol *self,
 }
 
 static PyObject *
-symbol_get_const_int (PyGISourceSymbol *self,
-		      void             *context)
+symbol_const_int_to_py (GISourceSymbol *symbol)
 {
-  if (!self->symbol->const_int_set)
+  if (!symbol->const_int_set)
     {
       Py_INCREF(Py_None);
       return Py_None;
     }
 
-  if (self->symbol->const_int_is_unsigned)
-    return PyLong_FromUnsignedLongLong ((unsigned long long)self->symbol->const_int);
+  if (symbol->const_int_is_unsigned)
+    return PyLong_FromUnsignedLongLong ((unsigned long long)symbol->const_int);
   else
-    return PyLong_FromLongLong ((long long)self->symbol->const_int);
+    return PyLong_FromLongLong ((long long)symbol->const_int);
 }
 
 static PyObject *
-symbol_get_const_double (PyGISourceSymbol *self,
-                         void             *context)
+symbol_const_double_to_py (GISourceSymbol *symbol)
 {
-  if (!self->symbol->const_double_set)
+  if (!symbol->const_double_set)
     {
       Py_INCREF(Py_None);
       return Py_None;
     }
-  return PyFloat_FromDouble (self->symbol->const_double);
+  return PyFloat_FromDouble (symbol->const_double);
+}
+
+static PyObject *
+symbol_const_boolean_to_py (GISourceSymbol *symbol)
+{
+  if (!symbol->const_boolean_set)
+    {
+      Py_INCREF(Py_None);
+      return Py_None;
+    }
+
+  return PyBool_FromLong (symbol->const_boolean);
+}
+
+static PyObject *
+symbol_get_const_int (PyGISourceSymbol *self,
+		      void             *context)
+{
+  return symbol_const_int_to_py (self->symbol);
+}
+
+static PyObject *
+symbol_get_const_double (PyGISourceSymbol *self,
+                         void             *context)
+{
+  return symbol_const_double_to_py (self->symbol);
 }
 
 static PyObject *
@@ -196,13 +220,7 @@ static PyObject *
 symbol_get_const_boolean (PyGISourceSymbol *self,
 			  void             *context)
 {
-  if (!self->symbol->const_boolean_set)
-    {
-      Py_INCREF(Py_None);
-      return Py_None;
-    }
-
-  return PyBool_FromLong (self->symbol->const_boolean);
+  return symbol_const_boolean_to_py (self->symbol);
 }
 
 static PyObject *
@@ -417,6 +435,31 @@ pygi_source_scanner_parse_macros (PyGISourceScanner *self,
   return Py_None;
 }
 
+static PyObject *
+pygi_source_scanner_scan_macros (PyGISourceScanner *self,
+                                 PyObject          *args)
+{
+  char *filename;
+  int comments;
+
+  if (!PyArg_ParseTuple (args, "si:SourceScanner.scan_macros", &filename, &comments))
+    return NULL;
+
+  gi_source_scanner_scan_macros (self->scanner, filename, comments);
+
+  Py_INCREF (Py_None);
+  return Py_None;
+}
+
+static PyObject *
+pygi_source_scanner_parse_scanned_macros (PyGISourceScanner *self)
+{
+  gi_source_scanner_parse_scanned_macros (self->scanner);
+
+  Py_INCREF (Py_None);
+  return Py_None;
+}
+
 static PyObject *
 pygi_source_scanner_parse_file (PyGISourceScanner *self,
 				PyObject          *args)
@@ -544,6 +587,251 @@ pygi_source_scanner_lex_filename (PyGISourceScanner *self,
   return Py_None;
 }
 
+static PyObject *
+pygi_source_scanner_scan_comments (PyGISourceScanner *self,
+                                   PyObject          *args)
+{
+  char *filename;
+
+  if (!PyArg_ParseTuple (args, "s:SourceScanner.scan_comments", &filename))
+    return NULL;
+
+  if (!gi_source_scanner_scan_comments (self->scanner, filename))
+    {
+      PyErr_SetFromErrnoWithFilename (PyExc_IOError, filename);
+      return NULL;
+    }
+
+  Py_INCREF (Py_None);
+  return Py_None;
+}
+
+static GList *
+string_list_from_py (PyObject *list)
+{
+  GList *strings = NULL;
+  Py_ssize_t i;
+
+  for (i = 0; i < PyList_GET_SIZE (list); i++)
+    {
+      char *string = PyString_AsString (PyList_GET_ITEM (list, i));
+
+      if (string == NULL)
+        {
+          g_list_free (strings);
+          return NULL;
+        }
+      strings = g_list_prepend (strings, string);
+    }
+
+  return g_list_reverse (strings);
+}
+
+static PyObject *
+pygi_source_scanner_set_baseline (PyGISourceScanner *self,
+                                  PyObject          *args)
+{
+  PyObject *py_filenames, *py_typedefs, *py_constants;
+  GList *filenames = NULL, *typedefs = NULL, *constants = NULL;
+  PyObject *result = NULL;
+  Py_ssize_t i;
+
+  if (!PyArg_ParseTuple (args, "O!O!O!:SourceScanner.set_baseline",
+                         &PyList_Type, &py_filenames,
+                         &PyList_Type, &py_typedefs,
+                         &PyList_Type, &py_constants))
+    return NULL;
+
+  filenames = string_list_from_py (py_filenames);
+  if (filenames == NULL && PyErr_Occurred ())
+    goto out;
+
+  for (i = 0; i < PyList_GET_SIZE (py_typedefs); i++)
+    {
+      GISourceSymbol *symbol;
+      GFile *file;
+      char *ident, *filename;
+      int line;
+
+      if (!PyArg_ParseTuple (PyList_GET_ITEM (py_typedefs, i), "ssi",
+                             &ident, &filename, &line))
+        goto out;
+
+      file = g_file_new_for_path (filename);
+      symbol = gi_source_symbol_new (CSYMBOL_TYPE_TYPEDEF, file, line);
+      g_object_unref (file);
+      symbol->ident = g_strdup (ident);
+      typedefs = g_list_prepend (typedefs, symbol);
+    }
+  typedefs = g_list_reverse (typedefs);
+
+  for (i = 0; i < PyList_GET_SIZE (py_constants); i++)
+    {
+      GISourceSymbol *symbol;
+      GFile *file;
+      char *ident, *filename;
+      PyObject *value;
+      int is_unsigned, line;
+
+      if (!PyArg_ParseTuple (PyList_GET_ITEM (py_constants, i), "sOisi",
+                             &ident, &value, &is_unsigned, &filename, &line))
+        goto out;
+
+      file = g_file_new_for_path (filename);
+      symbol = gi_source_symbol_new (CSYMBOL_TYPE_OBJECT, file, line);
+      g_object_unref (file);
+      symbol->ident = g_strdup (ident);
+      symbol->const_int_set = TRUE;
+      symbol->const_int_is_unsigned = is_unsigned;
+      if (is_unsigned)
+        symbol->const_int = (gint64) PyLong_AsUnsignedLongLong (value);
+      else
+        symbol->const_int = PyLong_AsLongLong (value);
+      constants = g_list_prepend (constants, symbol);
+
+      if (PyErr_Occurred ())
+        goto out;
+    }
+  constants = g_list_reverse (constants);
+
+  gi_source_scanner_set_baseline (self->scanner, filenames, typedefs, constants);
+
+  Py_INCREF (Py_None);
+  result = Py_None;
+
+out:
+  g_list_free (filenames);
+  g_list_free_full (typedefs, (GDestroyNotify)gi_source_symbol_unref);
+  g_list_free_full (constants, (GDestroyNotify)gi_source_symbol_unref);
+  return result;
+}
+
+static PyObject *
+pygi_source_scanner_get_baseline (PyGISourceScanner *self)
+{
+  GHashTableIter iter;
+  gpointer key, value;
+  PyObject *filenames, *typedefs, *constants, *item;
+
+  filenames = PyList_New (0);
+  typedefs = PyList_New (0);
+  constants = PyList_New (0);
+  if (filenames == NULL || typedefs == NULL || constants == NULL)
+    goto error;
+
+  g_hash_table_iter_init (&iter, self->scanner->parsed_files);
+  while (g_hash_table_iter_next (&iter, &key, NULL))
+    {
+      item = PyString_FromString (key);
+      if (item == NULL || PyList_Append (filenames, item) < 0)
+        goto error_item;
+      Py_DECREF (item);
+    }
+
+  g_hash_table_iter_init (&iter, self->scanner->declared_typedefs);
+  while (g_hash_table_iter_next (&iter, &key, &value))
+    {
+      GISourceSymbol *symbol = value;
+
+      item = Py_BuildValue ("(ssi)",
+                            key,
+                            symbol->source_filename,
+                            symbol->line);
+      if (item == NULL || PyList_Append (typedefs, item) < 0)
+        goto error_item;
+      Py_DECREF (item);
+    }
+
+  g_hash_table_iter_init (&iter, self->scanner->declared_constants);
+  while (g_hash_table_iter_next (&iter, &key, &value))
+    {
+      GISourceSymbol *symbol = value;
+
+      item = Py_BuildValue ("(sNisi)",
+                            key,
+                            symbol_const_int_to_py (symbol),
+                            symbol->const_int_is_unsigned,
+                            symbol->source_filename,
+                            symbol->line);
+      if (item == NULL || PyList_Append (constants, item) < 0)
+        goto error_item;
+      Py_DECREF (item);
+    }
+
+  return Py_BuildValue ("(NNN)", filenames, typedefs, constants);
+
+error_item:
+  Py_XDECREF (item);
+error:
+  Py_XDECREF (filenames);
+  Py_XDECREF (typedefs);
+  Py_XDECREF (constants);
+  return NULL;
+}
+
+static char **
+strv_from_py (PyObject *list)
+{
+  GPtrArray *strings;
+  Py_ssize_t i;
+
+  if (list == Py_None)
+    return NULL;
+
+  strings = g_ptr_array_new ();
+  for (i = 0; i < PyList_GET_SIZE (list); i++)
+    {
+      char *string = PyString_AsString (PyList_GET_ITEM (list, i));
+
+      if (string == NULL)
+        {
+          g_ptr_array_free (strings, TRUE);
+          return NULL;
+        }
+      g_ptr_array_add (strings, string);
+    }
+  g_ptr_array_add (strings, NULL);
+
+  return (char **) g_ptr_array_free (strings, FALSE);
+}
+
+static PyObject *
+pygi_source_scanner_set_symbol_filter (PyGISourceScanner *self,
+                                       PyObject          *args)
+{
+  PyObject *py_prefixes, *py_ucase_prefixes;
+  char **prefixes = NULL, **ucase_prefixes = NULL;
+
+  if (!PyArg_ParseTuple (args, "OO:SourceScanner.set_symbol_filter",
+                         &py_prefixes, &py_ucase_prefixes))
+    return NULL;
+
+  if ((py_prefixes != Py_None && !PyList_Check (py_prefixes)) ||
+      (py_ucase_prefixes != Py_None && !PyList_Check (py_ucase_prefixes)))
+    {
+      PyErr_SetString (PyExc_TypeError, "prefixes must be lists or None");
+      return NULL;
+    }
+
+  prefixes = strv_from_py (py_prefixes);
+  if (PyErr_Occurred ())
+    return NULL;
+  ucase_prefixes = strv_from_py (py_ucase_prefixes);
+  if (PyErr_Occurred ())
+    {
+      g_free (prefixes);
+      return NULL;
+    }
+
+  /* The strings belong to the Python lists, they are copied */
+  gi_source_scanner_set_symbol_filter (self->scanner, prefixes, ucase_prefixes);
+  g_free (prefixes);
+  g_free (ucase_prefixes);
+
+  Py_INCREF (Py_None);
+  return Py_None;
+}
+
 static PyObject *
 pygi_source_scanner_set_macro_scan (PyGISourceScanner *self,
 				    PyObject          *args)
@@ -580,6 +868,40 @@ pygi_source_scanner_get_symbols (PyGISourceScanner *self)
   return list;
 }
 
+static PyObject *
+pygi_source_scanner_get_bounds (PyGISourceScanner *self)
+{
+  /* What get_symbols() and get_comments() would return the length of */
+  return Py_BuildValue ("(ii)",
+                        g_slist_length (self->scanner->symbols),
+                        g_slist_length (self->scanner->comments));
+}
+
+static PyObject *
+pygi_source_scanner_get_filenames (PyGISourceScanner *self)
+{
+  PyObject *list;
+  guint i;
+
+  list = PyList_New (self->scanner->filenames->len);
+  if (list == NULL)
+    return NULL;
+
+  for (i = 0; i < self->scanner->filenames->len; i++)
+    {
+      PyObject *item = PyString_FromString (g_ptr_array_index (self->scanner->filenames, i));
+
+      if (item == NULL)
+        {
+          Py_DECREF (list);
+          return NULL;
+        }
+      PyList_SET_ITEM (list, i, item);
+    }
+
+  return list;
+}
+
 static PyObject *
 pygi_source_scanner_get_comments (PyGISourceScanner *self)
 {
@@ -593,8 +915,9 @@ pygi_source_scanner_get_comments (PyGISourceScanner *self)
   for (l = comments; l; l = l->next)
     {
       GISourceComment *comment = l->data;
-      PyObject *item = Py_BuildValue ("(ssi)", comment->comment,
-                                      comment->filename,
+      PyObject *item = Py_BuildValue ("(sii)", comment->comment,
+                                      gi_source_scanner_get_file_id (self->scanner,
+                                                                     comment->filename),
                                       comment->line);
       PyList_SetItem (list, i++, item);
     }
@@ -604,13 +927,255 @@ pygi_source_scanner_get_comments (PyGISourceScanner *self)
   return list;
 }
 
+/*
+ * The symbol table is exported as flat tuples, symbols and types refer to
+ * each other with their index in the table, or -1 for NULL:
+ *
+ * symbol: (type, ident, base_type, const_int, const_double, const_string,
+ *          const_boolean, file_id, line, private)
+ * type: (type, storage_class_specifier, type_qualifier, function_specifier,
+ *        name, base_type, (child, ...), is_bitfield)
+ *
+ * Unless the filter is turned off, the symbols which are dropped by
+ * gi_source_scanner_filter_symbol() are -1 in the roots, and the stubs
+ * have no base type nor value.
+ *
+ * The file_id of the symbols and comments is an index in the list
+ * returned by get_filenames(), or -1.
+ */
+typedef struct {
+  GISourceScanner *scanner;
+  GHashTable *symbol_indices;
+  GHashTable *type_indices;
+  PyObject *symbols;
+  PyObject *types;
+} SymbolTable;
+
+#define TABLE_ERROR -2
+
+static int symbol_table_add_type (SymbolTable *table, GISourceType *type);
+
+static int
+symbol_file_id (SymbolTable    *table,
+                GISourceSymbol *symbol)
+{
+  if (symbol->source_filename == NULL)
+    return -1;
+  return gi_source_scanner_get_file_id (table->scanner, symbol->source_filename);
+}
+
+static int
+symbol_table_add_stub (SymbolTable    *table,
+                       GISourceSymbol *symbol)
+{
+  PyObject *item;
+  int index;
+
+  item = Py_BuildValue ("(isiOOOOiiN)",
+                        symbol->type,
+                        symbol->ident,
+                        -1,
+                        Py_None,
+                        Py_None,
+                        Py_None,
+                        Py_None,
+                        symbol_file_id (table, symbol),
+                        symbol->line,
+                        PyBool_FromLong (symbol->private));
+  if (item == NULL)
+    return TABLE_ERROR;
+
+  index = PyList_GET_SIZE (table->symbols);
+  if (PyList_Append (table->symbols, item) < 0)
+    index = TABLE_ERROR;
+  Py_DECREF (item);
+  return index;
+}
+
+static int
+symbol_table_add_symbol (SymbolTable    *table,
+                         GISourceSymbol *symbol)
+{
+  gpointer value;
+  PyObject *item;
+  int index, base_type;
+
+  if (symbol == NULL)
+    return -1;
+
+  if (g_hash_table_lookup_extended (table->symbol_indices, symbol, NULL, &value))
+    return GPOINTER_TO_INT (value);
+
+  /* Reserve the index first, the symbol may be referenced from its type */
+  index = PyList_GET_SIZE (table->symbols);
+  g_hash_table_insert (table->symbol_indices, symbol, GINT_TO_POINTER (index));
+  if (PyList_Append (table->symbols, Py_None) < 0)
+    return TABLE_ERROR;
+
+  base_type = symbol_table_add_type (table, symbol->base_type);
+  if (base_type == TABLE_ERROR)
+    return TABLE_ERROR;
+
+  item = Py_BuildValue ("(iziNNzNiiN)",
+                        symbol->type,
+                        symbol->ident,
+                        base_type,
+                        symbol_const_int_to_py (symbol),
+                        symbol_const_double_to_py (symbol),
+                        symbol->const_string,
+                        symbol_const_boolean_to_py (symbol),
+                        symbol_file_id (table, symbol),
+                        symbol->line,
+                        PyBool_FromLong (symbol->private));
+  if (item == NULL)
+    return TABLE_ERROR;
+
+  PyList_SET_ITEM (table->symbols, index, item);
+  Py_DECREF (Py_None);
+  return index;
+}
+
+static int
+symbol_table_add_type (SymbolTable  *table,
+                       GISourceType *type)
+{
+  gpointer value;
+  PyObject *item, *children;
+  GList *l;
+  int index, base_type, i = 0;
+
+  if (type == NULL)
+    return -1;
+
+  if (g_hash_table_lookup_extended (table->type_indices, type, NULL, &value))
+    return GPOINTER_TO_INT (value);
+
+  index = PyList_GET_SIZE (table->types);
+  g_hash_table_insert (table->type_indices, type, GINT_TO_POINTER (index));
+  if (PyList_Append (table->types, Py_None) < 0)
+    return TABLE_ERROR;
+
+  base_type = symbol_table_add_type (table, type->base_type);
+  if (base_type == TABLE_ERROR)
+    return TABLE_ERROR;
+
+  children = PyTuple_New (g_list_length (type->child_list));
+  if (children == NULL)
+    return TABLE_ERROR;
+
+  for (l = type->child_list; l; l = l->next)
+    {
+      int child = symbol_table_add_symbol (table, l->data);
+
+      if (child == TABLE_ERROR)
+        {
+          Py_DECREF (children);
+          return TABLE_ERROR;
+        }
+      PyTuple_SET_ITEM (children, i++, PyInt_FromLong (child));
+    }
+
+  item = Py_BuildValue ("(iiiiziNi)",
+                        type->type,
+                        type->storage_class_specifier,
+                        type->type_qualifier,
+                        type->function_specifier,
+                        type->name,
+                        base_type,
+                        children,
+                        type->is_bitfield);
+  if (item == NULL)
+    return TABLE_ERROR;
+
+  PyList_SET_ITEM (table->types, index, item);
+  Py_DECREF (Py_None);
+  return index;
+}
+
+static PyObject *
+pygi_source_scanner_get_symbol_table (PyGISourceScanner *self,
+                                      PyObject          *args)
+{
+  SymbolTable table;
+  GSList *l, *symbols;
+  PyObject *roots, *result = NULL;
+  int filter = TRUE;
+
+  if (!PyArg_ParseTuple (args, "|i:SourceScanner.get_symbol_table", &filter))
+    return NULL;
+
+  table.scanner = self->scanner;
+  table.symbol_indices = g_hash_table_new (NULL, NULL);
+  table.type_indices = g_hash_table_new (NULL, NULL);
+  table.symbols = PyList_New (0);
+  table.types = PyList_New (0);
+  roots = PyList_New (0);
+
+  symbols = gi_source_scanner_get_symbols (self->scanner);
+
+  if (table.symbols == NULL || table.types == NULL || roots == NULL)
+    goto out;
+
+  for (l = symbols; l; l = l->next)
+    {
+      PyObject *item;
+      int index;
+
+      /* Dropped symbols keep their place in the roots, as -1 */
+      switch (filter ? gi_source_scanner_filter_symbol (self->scanner, l->data)
+                     : SYMBOL_FILTER_KEEP)
+        {
+        case SYMBOL_FILTER_DROP:
+          index = -1;
+          break;
+        case SYMBOL_FILTER_STUB:
+          index = symbol_table_add_stub (&table, l->data);
+          break;
+        default:
+          index = symbol_table_add_symbol (&table, l->data);
+          break;
+        }
+
+      if (index == TABLE_ERROR)
+        goto out;
+
+      item = PyInt_FromLong (index);
+      if (item == NULL || PyList_Append (roots, item) < 0)
+        {
+          Py_XDECREF (item);
+          goto out;
+        }
+      Py_DECREF (item);
+    }
+
+  result = Py_BuildValue ("(OOO)", table.symbols, table.types, roots);
+
+out:
+  g_slist_free (symbols);
+  g_hash_table_destroy (table.symbol_indices);
+  g_hash_table_destroy (table.type_indices);
+  Py_XDECREF (table.symbols);
+  Py_XDECREF (table.types);
+  Py_XDECREF (roots);
+  return result;
+}
+
 static const PyMethodDef _PyGISourceScanner_methods[] = {
   { "get_comments", (PyCFunction) pygi_source_scanner_get_comments, METH_NOARGS },
+  { "get_filenames", (PyCFunction) pygi_source_scanner_get_filenames, METH_NOARGS },
+  { "get_bounds", (PyCFunction) pygi_source_scanner_get_bounds, METH_NOARGS },
   { "get_symbols", (PyCFunction) pygi_source_scanner_get_symbols, METH_NOARGS },
+  { "get_symbol_table", (PyCFunction) pygi_source_scanner_get_symbol_table, METH_VARARGS },
   { "append_filename", (PyCFunction) pygi_source_scanner_append_filename, METH_VARARGS },
   { "parse_file", (PyCFunction) pygi_source_scanner_parse_file, METH_VARARGS },
   { "parse_macros", (PyCFunction) pygi_source_scanner_parse_macros, METH_VARARGS },
+  { "scan_macros", (PyCFunction) pygi_source_scanner_scan_macros, METH_VARARGS },
+  { "parse_scanned_macros", (PyCFunction) pygi_source_scanner_parse_scanned_macros, METH_NOARGS },
   { "lex_filename", (PyCFunction) pygi_source_scanner_lex_filename, METH_VARARGS },
+  { "scan_comments", (PyCFunction) pygi_source_scanner_scan_comments, METH_VARARGS },
+  { "set_baseline", (PyCFunction) pygi_source_scanner_set_baseline, METH_VARARGS },
+  { "get_baseline", (PyCFunction) pygi_source_scanner_get_baseline, METH_NOARGS },
+  { "set_symbol_filter", (PyCFunction) pygi_source_scanner_set_symbol_filter, METH_VARARGS },
   { "set_macro_scan", (PyCFunction) pygi_source_scanner_set_macro_scan, METH_VARARGS },
   { NULL, NULL, 0 }
 };
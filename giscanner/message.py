@@ -30,19 +30,64 @@ from . import utils
  FATAL) = range(3)
 
 
+# File names are shared by many positions, they only keep an index
+# in this table
+_filenames = []
+_file_ids = {}
+
+
+def intern_filename(filename):
+    """Return the file ID of filename, which can be given to Position
+    instead of the file name."""
+    file_id = _file_ids.get(filename)
+    if file_id is None:
+        file_id = _file_ids[filename] = len(_filenames)
+        _filenames.append(filename)
+    return file_id
+
+
+def get_filename(file_id):
+    """Return the file name of a file ID returned by intern_filename()."""
+    return _filenames[file_id]
+
+
 class Position(object):
     """
     Represents a position in the source file which we
-    want to inform about.
+    want to inform about.  The file is given by name or
+    by ID, see intern_filename().
     """
 
-    __slots__ = ('filename', 'line', 'column')
+    __slots__ = ('file_id', 'line', 'column')
+
+    # File IDs are only valid in the current process, the cache
+    # stores the file names
+    serialized_slots = ('filename', 'line', 'column')
 
     def __init__(self, filename=None, line=None, column=None):
-        self.filename = filename
+        if filename is None or isinstance(filename, int):
+            self.file_id = filename
+        else:
+            self.file_id = intern_filename(filename)
         self.line = line
         self.column = column
 
+    def _get_filename(self):
+        if self.file_id is None:
+            return None
+        return get_filename(self.file_id)
+
+    def _set_filename(self, filename):
+        self.file_id = None if filename is None else intern_filename(filename)
+
+    filename = property(_get_filename, _set_filename)
+
+    def __getstate__(self):
+        return (self.filename, self.line, self.column)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
     def __cmp__(self, other):
         return cmp((self.filename, self.line, self.column),
                    (other.filename, other.line, other.column))
@@ -21,6 +21,8 @@
 #
 
 import errno
+import glob
+import multiprocessing
 import optparse
 import os
 import shutil
@@ -32,6 +34,7 @@ import platform
 from giscanner import message
 from giscanner.annotationparser import GtkDocCommentBlockParser
 from giscanner.ast import Include, Namespace
+from giscanner.cachestore import CacheStore
 from giscanner.dumper import compile_introspection_binary
 from giscanner.gdumpparser import GDumpParser, IntrospectionBinary
 from giscanner.introspectablepass import IntrospectablePass
@@ -115,6 +118,9 @@ def _get_option_parser():
     parser.add_option("", "--add-include-path",
                       action="append", dest="include_paths", default=[],
                       help="include paths for other GIR files")
+    parser.add_option("", "--lazy-includes",
+                      action="store_true", dest="lazy_includes", default=False,
+                      help="only load the contents of included GIR files when needed")
     parser.add_option("", "--program",
                       action="store", dest="program", default=None,
                       help="program to execute")
@@ -169,6 +175,13 @@ the latter is not specified.""")
                       help='Filter symbols (function names) through the given '
                            'shell command which will receive the symbol name as input '
                            'to stdin and is expected to output the filtered results to stdout.')
+    parser.add_option("", "--filter-cmd-protocol",
+                      type="choice", choices=["oneshot", "lines"],
+                      action="store", dest="filter_cmd_protocol", default="oneshot",
+                      help='How names are given to --identifier-filter-cmd and '
+                           '--symbol-filter-cmd: "oneshot" starts the command for each '
+                           'name, "lines" starts it once and writes one name per line to '
+                           'its stdin, expecting one filtered name per line on its stdout.')
     parser.add_option("", "--accept-unprefixed",
                       action="store_true", dest="accept_unprefixed", default=False,
                       help="""If specified, accept symbols and identifiers that do not
@@ -200,6 +213,28 @@ match the namespace prefix.""")
     parser.add_option("", "--filelist",
                       action="store", dest="filelist", default=[],
                       help="file containing headers and sources to be scanned")
+    parser.add_option("", "--generate-system-cache",
+                      action="store_true", dest="generate_system_cache", default=False,
+                      help="generate the system cache for the GIR files or directories "
+                           "given as arguments and exit")
+    parser.add_option("", "--warm-cache",
+                      action="store_true", dest="warm_cache", default=False,
+                      help="parse all installed GIR files into the cache and exit")
+    parser.add_option("", "--prune-cache",
+                      action="store_true", dest="prune_cache", default=False,
+                      help="evict least recently used entries from the cache and exit")
+    parser.add_option("", "--jobs",
+                      action="store", dest="jobs", type="int", default=1,
+                      help="number of header shards to preprocess and parse concurrently")
+    parser.add_option("", "--cache-dependency-headers",
+                      action="store_true", dest="cache_dependency_headers", default=False,
+                      help="do not parse the headers which are not scanned if they did not change")
+    parser.add_option("", "--cache-headers",
+                      action="store_true", dest="cache_headers", default=False,
+                      help="only parse the scanned headers which changed since the last scan")
+    parser.add_option("", "--cache-source-comments",
+                      action="store_true", dest="cache_source_comments", default=False,
+                      help="only read the source files which changed since the last scan")
 
     group = get_preprocessor_option_group(parser)
     parser.add_option_group(group)
@@ -253,6 +288,66 @@ def passthrough_gir(path, f):
     f.write(writer.get_xml())
 
 
+def generate_system_cache(paths):
+    store = CacheStore()
+    for path in paths:
+        if os.path.isdir(path):
+            filenames = sorted(glob.glob(os.path.join(path, '*.gir')))
+        else:
+            filenames = [path]
+        for filename in filenames:
+            # Both variants used by Transformer._parse_include()
+            for variant, types_only in (('types', True), ('full', False)):
+                parser = GIRParser(types_only=types_only)
+                parser.parse(filename)
+                try:
+                    store.store_system(filename, parser.get_namespace(), variant)
+                except EnvironmentError as e:
+                    _error("while writing the system cache for %s: %s" % (
+                        filename, e.strerror))
+        if os.path.isdir(path):
+            store.clean_system(path, filenames)
+    return 0
+
+
+def _warm_cache_file(args):
+    filename, passthrough = args
+    transformer = Transformer(None)
+    if passthrough:
+        transformer.set_passthrough_mode()
+    try:
+        transformer.load_gir(filename)
+    except Exception as e:
+        return filename, str(e)
+    return filename, None
+
+
+def warm_cache(include_paths, passthrough=False):
+    if 'GI_SCANNER_DISABLE_CACHE' in os.environ:
+        _error('The cache is disabled')
+
+    transformer = Transformer(None)
+    transformer.set_include_paths(include_paths)
+    # Only the files which _find_include() would pick
+    filenames = {}
+    for searchdir in transformer.get_gir_search_path():
+        for filename in sorted(glob.glob(os.path.join(searchdir, '*.gir'))):
+            filenames.setdefault(os.path.basename(filename), filename)
+
+    failed = 0
+    pool = multiprocessing.Pool()
+    try:
+        tasks = [(filename, passthrough) for name, filename in sorted(filenames.items())]
+        for filename, error in pool.imap_unordered(_warm_cache_file, tasks):
+            if error is not None:
+                sys.stderr.write("Failed to parse %s: %s\n" % (filename, error))
+                failed += 1
+    finally:
+        pool.close()
+        pool.join()
+    return 1 if failed else 0
+
+
 def test_codegen(optstring,
                  function_decoration,
                  include_first_header,
@@ -373,8 +468,11 @@ def create_transformer(namespace, options):
     transformer = Transformer(namespace,
                               accept_unprefixed=options.accept_unprefixed,
                               identifier_filter_cmd=options.identifier_filter_cmd,
-                              symbol_filter_cmd=options.symbol_filter_cmd)
+                              symbol_filter_cmd=options.symbol_filter_cmd,
+                              filter_cmd_protocol=options.filter_cmd_protocol)
     transformer.set_include_paths(options.include_paths)
+    if options.lazy_includes:
+        transformer.set_lazy_includes()
     if options.passthrough_gir or options.reparse_validate_gir:
         transformer.disable_cache()
         transformer.set_passthrough_mode()
@@ -429,6 +527,13 @@ def create_source_scanner(options, args):
     # Run the preprocessor, tokenize and construct simple
     # objects representing the raw C symbols
     ss = SourceScanner()
+    ss.set_jobs(getattr(options, 'jobs', 1))
+    if getattr(options, 'cache_dependency_headers', False):
+        ss.set_baseline_cache(CacheStore())
+    if getattr(options, 'cache_headers', False):
+        ss.set_header_cache(CacheStore())
+    if getattr(options, 'cache_source_comments', False):
+        ss.set_comment_cache(CacheStore())
     ss.set_cpp_options(options.cpp_includes,
                        options.cpp_defines,
                        options.cpp_undefines,
@@ -477,6 +582,15 @@ def scanner_main(args):
     parser = _get_option_parser()
     (options, args) = parser.parse_args(args)
 
+    if options.generate_system_cache:
+        if not args[1:]:
+            _error('Need at least one GIR file or directory')
+        return generate_system_cache(args[1:])
+    if options.warm_cache:
+        return warm_cache(options.include_paths)
+    if options.prune_cache:
+        CacheStore().prune()
+        return 0
     if options.passthrough_gir:
         passthrough_gir(options.passthrough_gir, sys.stdout)
     if options.test_codegen:
@@ -519,6 +633,7 @@ def scanner_main(args):
             return exit_code
 
     ss = create_source_scanner(options, args)
+    ss.set_symbol_filter(*transformer.get_symbol_filter_prefixes())
 
     cbp = GtkDocCommentBlockParser()
     blocks = cbp.parse_comment_blocks(ss.get_comments())
@@ -541,6 +656,9 @@ def scanner_main(args):
     final = IntrospectablePass(transformer, blocks)
     final.validate()
 
+    if utils.have_debug_flag('name-cache'):
+        sys.stderr.write(transformer.format_name_cache_statistics())
+
     warning_count = logger.get_warning_count()
     if options.warn_fatal and warning_count > 0:
         message.fatal("warnings configured as fatal")
@@ -42,6 +42,7 @@ extern char linebuf[2000];
 extern char *yytext;
 
 extern int yylex (GISourceScanner *scanner);
+extern void yyrestart (FILE *input_file);
 static void yyerror (GISourceScanner *scanner, const char *str);
 
 extern void ctype_free (GISourceType * type);
@@ -1094,6 +1095,8 @@ enumerator
 		$$->const_int_set = TRUE;
 		$$->const_int = ++last_enum_value;
 		g_hash_table_insert (const_table, g_strdup ($$->ident), gi_source_symbol_ref ($$));
+		if (!scanner->macro_scan)
+			g_hash_table_insert (scanner->declared_constants, g_strdup ($$->ident), gi_source_symbol_ref ($$));
 	  }
 	| identifier '=' constant_expression
 	  {
@@ -1103,6 +1106,8 @@ enumerator
 		$$->const_int = $3->const_int;
 		last_enum_value = $$->const_int;
 		g_hash_table_insert (const_table, g_strdup ($$->ident), gi_source_symbol_ref ($$));
+		if (!scanner->macro_scan)
+			g_hash_table_insert (scanner->declared_constants, g_strdup ($$->ident), gi_source_symbol_ref ($$));
 	  }
 	;
 
@@ -1595,6 +1600,109 @@ eat_line (FILE * f, int c)
   return pass_line (f, c, NULL);
 }
 
+/*
+ * Like parse_comment() in scannerlexer.l, called once the opening '/' and
+ * '*' characters have been read.  Returns the character following the
+ * comment.
+ */
+static int
+read_comment (GISourceScanner *scanner, FILE *f, int *line, GFile *file)
+{
+  GISourceComment *comment;
+  GString *string = NULL;
+  int comment_line = *line;
+  int c1, c2;
+
+  c1 = fgetc (f);
+  c2 = fgetc (f);
+
+  /* Only GTK-Doc comment blocks are stored, they start with one '/'
+   * followed by exactly two '*' and not followed by a '/' */
+  if (c2 != EOF && (c1 == '*' && c2 != '*' && c2 != '/'))
+    string = g_string_new ("/*");
+
+  while (c2 != EOF && !(c1 == '*' && c2 == '/'))
+    {
+      if (string)
+        g_string_append_c (string, c1);
+
+      if (c1 == '\n')
+        (*line)++;
+
+      c1 = c2;
+      c2 = fgetc (f);
+    }
+
+  if (string)
+    {
+      g_string_append (string, "*/");
+
+      comment = g_slice_new (GISourceComment);
+      comment->comment = g_string_free (string, FALSE);
+      comment->line = comment_line;
+      comment->filename = g_file_get_parse_name (file);
+
+      gi_source_scanner_take_comment (scanner, comment);
+    }
+
+  if (c2 == EOF)
+    return EOF;
+  return fgetc (f);
+}
+
+/*
+ * Like eat_line(), but collect the comment blocks starting in the line,
+ * skipping the ones which are inside string and character literals.
+ */
+static int
+eat_line_comments (GISourceScanner *scanner, FILE *f, int c, int *line,
+                   GFile *file)
+{
+  while (c != EOF && c != '\n')
+    {
+      if (c == '"' || c == '\'')
+        {
+          int quote = c;
+
+          c = fgetc (f);
+          while (c != EOF && c != quote && c != '\n')
+            {
+              if (c == '\\')
+                {
+                  c = fgetc (f);
+                  if (c == '\n')
+                    (*line)++;
+                }
+              if (c != EOF)
+                c = fgetc (f);
+            }
+          if (c == quote)
+            c = fgetc (f);
+          continue;
+        }
+
+      if (c == '/')
+        {
+          c = fgetc (f);
+          if (c == '/')
+            {
+              /* C++ style comment, ignore the rest of the line */
+              while (c != EOF && c != '\n')
+                c = fgetc (f);
+            }
+          else if (c == '*')
+            {
+              c = read_comment (scanner, f, line, file);
+            }
+          continue;
+        }
+
+      c = fgetc (f);
+    }
+
+  return eat_line (f, c);
+}
+
 static int
 read_identifier (FILE * f, int c, char **identifier)
 {
@@ -1608,116 +1716,117 @@ read_identifier (FILE * f, int c, char **identifier)
   return c;
 }
 
+/*
+ * Extract the preprocessor directives of filename, to be parsed later by
+ * gi_source_scanner_parse_scanned_macros().  If comments is set, the
+ * GTK-Doc comment blocks are collected in the same pass, which spares
+ * lexing source files a second time with gi_source_scanner_lex_filename().
+ */
 void
-gi_source_scanner_parse_macros (GISourceScanner *scanner, GList *filenames)
+gi_source_scanner_scan_macros (GISourceScanner *scanner,
+                               const gchar     *filename,
+                               gboolean         comments)
 {
-  GError *error = NULL;
-  char *tmp_name = NULL;
-  FILE *fmacros =
-    fdopen (g_file_open_tmp ("gen-introspect-XXXXXX.h", &tmp_name, &error),
-            "w+");
-  GList *l;
-  g_unlink (tmp_name);
+  FILE *f;
+  GFile *file = NULL;
+  int line = 1;
 
-  for (l = filenames; l != NULL; l = l->next)
+  GString *define_line;
+  char *str;
+  gboolean error_line = FALSE;
+  gboolean end_of_word;
+  int c;
+
+  if (scanner->macros == NULL)
+    {
+      GError *error = NULL;
+      char *tmp_name = NULL;
+
+      scanner->macros =
+        fdopen (g_file_open_tmp ("gen-introspect-XXXXXX.h", &tmp_name, &error),
+                "w+");
+      g_unlink (tmp_name);
+      g_free (tmp_name);
+    }
+
+  f = fopen (filename, "r");
+  if (f == NULL)
+    return;
+
+  if (comments)
+    file = g_file_new_for_path (filename);
+
+  c = eat_hspace (f);
+  while (c != EOF)
     {
-      FILE *f = fopen (l->data, "r");
-      int line = 1;
-
-      GString *define_line;
-      char *str;
-      gboolean error_line = FALSE;
-      gboolean end_of_word;
-      int c = eat_hspace (f);
-      while (c != EOF)
+      if (c != '#')
         {
-          if (c != '#')
-            {
-              /* ignore line */
-              c = eat_line (f, c);
-              line++;
-              continue;
-            }
+          /* ignore line, but keep the comments in it */
+          if (file)
+            c = eat_line_comments (scanner, f, c, &line, file);
+          else
+            c = eat_line (f, c);
+          line++;
+          continue;
+        }
 
-          /* print current location */
-          str = g_strescape (l->data, "");
-          fprintf (fmacros, "# %d \"%s\"\n", line, str);
+      /* print current location */
+      str = g_strescape (filename, "");
+      fprintf (scanner->macros, "# %d \"%s\"\n", line, str);
+      g_free (str);
+
+      c = eat_hspace (f);
+      c = read_identifier (f, c, &str);
+      end_of_word = (c == ' ' || c == '\t' || c == '\n' || c == EOF);
+      if (end_of_word &&
+          (g_str_equal (str, "if") ||
+           g_str_equal (str, "endif") ||
+           g_str_equal (str, "ifndef") ||
+           g_str_equal (str, "ifdef") ||
+           g_str_equal (str, "else") ||
+           g_str_equal (str, "elif")))
+        {
+          fprintf (scanner->macros, "#%s ", str);
           g_free (str);
-
-          c = eat_hspace (f);
-          c = read_identifier (f, c, &str);
-          end_of_word = (c == ' ' || c == '\t' || c == '\n' || c == EOF);
-          if (end_of_word &&
-              (g_str_equal (str, "if") ||
-               g_str_equal (str, "endif") ||
-               g_str_equal (str, "ifndef") ||
-               g_str_equal (str, "ifdef") ||
-               g_str_equal (str, "else") ||
-               g_str_equal (str, "elif")))
-            {
-              fprintf (fmacros, "#%s ", str);
-              g_free (str);
-              c = pass_line (f, c, fmacros);
-              line++;
-              continue;
-            }
-          else if (strcmp (str, "define") != 0 || !end_of_word)
-            {
-              g_free (str);
-              /* ignore line */
-              c = eat_line (f, c);
-              line++;
-              continue;
-            }
+          c = pass_line (f, c, scanner->macros);
+          line++;
+          continue;
+        }
+      else if (strcmp (str, "define") != 0 || !end_of_word)
+        {
           g_free (str);
-          c = eat_hspace (f);
-          c = read_identifier (f, c, &str);
-          if (strlen (str) == 0 || (c != ' ' && c != '\t' && c != '('))
-            {
-              g_free (str);
-              /* ignore line */
-              c = eat_line (f, c);
-              line++;
-              continue;
-            }
-          define_line = g_string_new ("#define ");
-          g_string_append (define_line, str);
+          /* ignore line */
+          c = eat_line (f, c);
+          line++;
+          continue;
+        }
+      g_free (str);
+      c = eat_hspace (f);
+      c = read_identifier (f, c, &str);
+      if (strlen (str) == 0 || (c != ' ' && c != '\t' && c != '('))
+        {
           g_free (str);
-          if (c == '(')
+          /* ignore line */
+          c = eat_line (f, c);
+          line++;
+          continue;
+        }
+      define_line = g_string_new ("#define ");
+      g_string_append (define_line, str);
+      g_free (str);
+      if (c == '(')
+        {
+          while (c != ')')
             {
-              while (c != ')')
-                {
-                  g_string_append_c (define_line, c);
-                  c = fgetc (f);
-                  if (c == EOF || c == '\n')
-                    {
-                      error_line = TRUE;
-                      break;
-                    }
-                }
-              if (error_line)
-                {
-                  g_string_free (define_line, TRUE);
-                  /* ignore line */
-                  c = eat_line (f, c);
-                  line++;
-                  continue;
-                }
-
-              g_assert (c == ')');
               g_string_append_c (define_line, c);
               c = fgetc (f);
-
-              /* found function-like macro */
-              fprintf (fmacros, "%s\n", define_line->str);
-
-              g_string_free (define_line, TRUE);
-              /* ignore rest of line */
-              c = eat_line (f, c);
-              line++;
-              continue;
+              if (c == EOF || c == '\n')
+                {
+                  error_line = TRUE;
+                  break;
+                }
             }
-          if (c != ' ' && c != '\t')
+          if (error_line)
             {
               g_string_free (define_line, TRUE);
               /* ignore line */
@@ -1725,37 +1834,130 @@ gi_source_scanner_parse_macros (GISourceScanner *scanner, GList *filenames)
               line++;
               continue;
             }
-          while (c != EOF && c != '\n')
+
+          g_assert (c == ')');
+          g_string_append_c (define_line, c);
+          c = fgetc (f);
+
+          /* found function-like macro */
+          fprintf (scanner->macros, "%s\n", define_line->str);
+
+          g_string_free (define_line, TRUE);
+          /* ignore rest of line */
+          c = eat_line (f, c);
+          line++;
+          continue;
+        }
+      if (c != ' ' && c != '\t')
+        {
+          g_string_free (define_line, TRUE);
+          /* ignore line */
+          c = eat_line (f, c);
+          line++;
+          continue;
+        }
+      while (c != EOF && c != '\n')
+        {
+          g_string_append_c (define_line, c);
+          c = fgetc (f);
+          if (c == '\\')
             {
-              g_string_append_c (define_line, c);
               c = fgetc (f);
-              if (c == '\\')
+              if (c == '\n')
                 {
+                  /* fold lines when seeing backslash new-line sequence */
                   c = fgetc (f);
-                  if (c == '\n')
-                    {
-                      /* fold lines when seeing backslash new-line sequence */
-                      c = fgetc (f);
-                    }
-                  else
-                    {
-                      g_string_append_c (define_line, '\\');
-                    }
+                }
+              else
+                {
+                  g_string_append_c (define_line, '\\');
                 }
             }
+        }
 
-          /* found object-like macro */
-          fprintf (fmacros, "%s\n", define_line->str);
+      /* found object-like macro */
+      fprintf (scanner->macros, "%s\n", define_line->str);
 
-          c = eat_line (f, c);
-          line++;
-        }
+      c = eat_line (f, c);
+      line++;
+    }
+
+  fclose (f);
 
-      fclose (f);
+  if (file)
+    g_object_unref (file);
+}
+
+/*
+ * Only collect the GTK-Doc comment blocks of filename, without
+ * preprocessing it nor writing its macros out.  This is all
+ * g-ir-annotation-tool --extract needs.
+ */
+gboolean
+gi_source_scanner_scan_comments (GISourceScanner *scanner,
+                                 const gchar     *filename)
+{
+  FILE *f;
+  GFile *file;
+  int line = 1;
+  int c;
+
+  f = fopen (filename, "r");
+  if (f == NULL)
+    return FALSE;
+
+  file = g_file_new_for_path (filename);
+
+  c = fgetc (f);
+  while (c != EOF)
+    {
+      c = eat_line_comments (scanner, f, c, &line, file);
+      line++;
     }
 
-  rewind (fmacros);
-  gi_source_scanner_parse_file (scanner, fmacros);
+  fclose (f);
+  g_object_unref (file);
+
+  return TRUE;
+}
+
+void
+gi_source_scanner_parse_scanned_macros (GISourceScanner *scanner)
+{
+  if (scanner->macros == NULL)
+    return;
+
+  rewind (scanner->macros);
+  gi_source_scanner_parse_file (scanner, scanner->macros);
+  fclose (scanner->macros);
+  scanner->macros = NULL;
+}
+
+void
+gi_source_scanner_parse_macros (GISourceScanner *scanner, GList *filenames)
+{
+  GList *l;
+
+  for (l = filenames; l != NULL; l = l->next)
+    gi_source_scanner_scan_macros (scanner, l->data, FALSE);
+
+  gi_source_scanner_parse_scanned_macros (scanner);
+}
+
+/*
+ * A previous parse may have been aborted on a syntax error, in the
+ * middle of its input: none of its state is kept.
+ */
+static void
+reset_lexer (GISourceScanner *scanner, FILE *file)
+{
+  scanner->lex_depth = 0;
+  scanner->lex_last_token = ';';
+  scanner->lex_dropping = FALSE;
+
+  lineno = 1;
+  yyin = file;
+  yyrestart (file);
 }
 
 gboolean
@@ -1766,8 +1968,22 @@ gi_source_scanner_parse_file (GISourceScanner *scanner, FILE *file)
   const_table = g_hash_table_new_full (g_str_hash, g_str_equal,
 				       g_free, (GDestroyNotify)gi_source_symbol_unref);
 
-  lineno = 1;
-  yyin = file;
+  /* The enumerations of the files skipped thanks to the baseline can
+   * still be used in constant expressions */
+  if (scanner->use_baseline && !scanner->macro_scan)
+    {
+      GHashTableIter iter;
+      gpointer key, value;
+
+      g_hash_table_iter_init (&iter, scanner->declared_constants);
+      while (g_hash_table_iter_next (&iter, &key, &value))
+        g_hash_table_insert (const_table, g_strdup (key), gi_source_symbol_ref (value));
+    }
+
+  scanner->in_foreign_file = FALSE;
+  scanner->in_baseline_file = FALSE;
+
+  reset_lexer (scanner, file);
   yyparse (scanner);
 
   g_hash_table_destroy (const_table);
@@ -1781,13 +1997,18 @@ gi_source_scanner_parse_file (GISourceScanner *scanner, FILE *file)
 gboolean
 gi_source_scanner_lex_filename (GISourceScanner *scanner, const gchar *filename)
 {
-  lineno = 1;
-  yyin = fopen (filename, "r");
+  FILE *f;
 
+  f = fopen (filename, "r");
+  if (f == NULL)
+    return FALSE;
+
+  reset_lexer (scanner, f);
   while (yylex (scanner) != YYEOF)
     ;
 
-  fclose (yyin);
+  fclose (f);
+  yyin = NULL;
 
   return TRUE;
 }
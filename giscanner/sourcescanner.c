@@ -221,6 +221,16 @@ gi_source_scanner_new (void)
   scanner->files = g_hash_table_new_full (g_file_hash, (GEqualFunc)g_file_equal,
                                           g_object_unref, NULL);
   g_queue_init (&scanner->conditionals);
+  scanner->parsed_files = g_hash_table_new_full (g_str_hash, g_str_equal,
+                                                  g_free, NULL);
+  scanner->declared_typedefs = g_hash_table_new_full (g_str_hash, g_str_equal, g_free,
+                                                      (GDestroyNotify)gi_source_symbol_unref);
+  scanner->declared_constants = g_hash_table_new_full (g_str_hash, g_str_equal, g_free,
+                                                       (GDestroyNotify)gi_source_symbol_unref);
+  scanner->baseline_files = g_hash_table_new_full (g_str_hash, g_str_equal,
+                                                   g_free, NULL);
+  scanner->file_ids = g_hash_table_new (g_str_hash, g_str_equal);
+  scanner->filenames = g_ptr_array_new_with_free_func (g_free);
   return scanner;
 }
 
@@ -247,6 +257,173 @@ gi_source_scanner_free (GISourceScanner *scanner)
   g_hash_table_unref (scanner->files);
 
   g_queue_clear (&scanner->conditionals);
+
+  if (scanner->macros)
+    fclose (scanner->macros);
+
+  g_hash_table_destroy (scanner->parsed_files);
+  g_hash_table_destroy (scanner->declared_typedefs);
+  g_hash_table_destroy (scanner->declared_constants);
+  g_hash_table_destroy (scanner->baseline_files);
+
+  g_strfreev (scanner->symbol_prefixes);
+  g_strfreev (scanner->ucase_symbol_prefixes);
+
+  g_hash_table_destroy (scanner->file_ids);
+  g_ptr_array_free (scanner->filenames, TRUE);
+}
+
+/**
+ * gi_source_scanner_get_file_id:
+ * @scanner: scanner instance
+ * @filename: a file name
+ *
+ * Returns: the index of @filename in the filenames of @scanner, which
+ * is added if needed.  Symbols and comments are exported with these
+ * indexes so that each file name is only exported once.
+ */
+int
+gi_source_scanner_get_file_id (GISourceScanner *scanner,
+                               const char      *filename)
+{
+  gpointer value;
+  char *key;
+
+  if (g_hash_table_lookup_extended (scanner->file_ids, filename, NULL, &value))
+    return GPOINTER_TO_INT (value);
+
+  /* The hash table borrows the names owned by the array */
+  key = g_strdup (filename);
+  g_ptr_array_add (scanner->filenames, key);
+  g_hash_table_insert (scanner->file_ids, key,
+                       GINT_TO_POINTER (scanner->filenames->len - 1));
+  return scanner->filenames->len - 1;
+}
+
+/**
+ * gi_source_scanner_set_baseline:
+ * @scanner: scanner instance
+ * @filenames: (element-type utf8): files whose declarations are known
+ * @typedefs: (element-type GISourceSymbol): typedefs declared in them
+ * @constants: (element-type GISourceSymbol): enumeration values declared
+ *   in them
+ *
+ * Seeds the scanner with the declarations of files which were parsed
+ * before, as returned by a previous scan in parsed_files,
+ * declared_typedefs and declared_constants.  The parser then skips the
+ * declarations of @filenames, they are only needed to tell typedef
+ * names and constants apart.
+ */
+void
+gi_source_scanner_set_baseline (GISourceScanner *scanner,
+                                GList           *filenames,
+                                GList           *typedefs,
+                                GList           *constants)
+{
+  GList *l;
+
+  for (l = filenames; l; l = l->next)
+    g_hash_table_add (scanner->baseline_files, g_strdup (l->data));
+
+  for (l = typedefs; l; l = l->next)
+    {
+      GISourceSymbol *symbol = l->data;
+
+      g_hash_table_insert (scanner->typedef_table, g_strdup (symbol->ident),
+                           GINT_TO_POINTER (TRUE));
+      g_hash_table_insert (scanner->declared_typedefs, g_strdup (symbol->ident),
+                           gi_source_symbol_ref (symbol));
+    }
+
+  for (l = constants; l; l = l->next)
+    {
+      GISourceSymbol *symbol = l->data;
+
+      g_hash_table_insert (scanner->declared_constants, g_strdup (symbol->ident),
+                           gi_source_symbol_ref (symbol));
+    }
+
+  scanner->use_baseline = TRUE;
+}
+
+/**
+ * gi_source_scanner_set_symbol_filter:
+ * @scanner: scanner instance
+ * @symbol_prefixes: (array zero-terminated=1) (allow-none): prefixes of
+ *   the lower case functions and constants of the namespace, including
+ *   the trailing underscore
+ * @ucase_symbol_prefixes: (array zero-terminated=1) (allow-none): same
+ *   for the upper case ones
+ *
+ * Enables gi_source_scanner_filter_symbol().  The prefixes are only
+ * given when a symbol which does not start with one of them is known not
+ * to belong to the namespace.
+ */
+void
+gi_source_scanner_set_symbol_filter (GISourceScanner  *scanner,
+                                     char            **symbol_prefixes,
+                                     char            **ucase_symbol_prefixes)
+{
+  g_strfreev (scanner->symbol_prefixes);
+  g_strfreev (scanner->ucase_symbol_prefixes);
+  scanner->symbol_prefixes = g_strdupv (symbol_prefixes);
+  scanner->ucase_symbol_prefixes = g_strdupv (ucase_symbol_prefixes);
+  scanner->filter_symbols = TRUE;
+}
+
+/**
+ * gi_source_scanner_filter_symbol:
+ * @scanner: scanner instance
+ * @symbol: a symbol found by the scanner
+ *
+ * Tells what the transformer needs from @symbol: variables and private
+ * functions and constants are ignored, and functions and constants
+ * outside the namespace are only reported by name.  Types always have
+ * to be kept, they are resolved across namespaces.
+ */
+SymbolFilterResult
+gi_source_scanner_filter_symbol (GISourceScanner *scanner,
+                                 GISourceSymbol  *symbol)
+{
+  char **prefixes;
+
+  if (!scanner->filter_symbols)
+    return SYMBOL_FILTER_KEEP;
+
+  switch (symbol->type)
+    {
+    case CSYMBOL_TYPE_OBJECT:
+      return SYMBOL_FILTER_DROP;
+    case CSYMBOL_TYPE_CONST:
+      /* Constants are only public when they come from a header */
+      if (symbol->source_filename == NULL ||
+          !g_str_has_suffix (symbol->source_filename, ".h"))
+        return SYMBOL_FILTER_DROP;
+      break;
+    case CSYMBOL_TYPE_FUNCTION:
+      break;
+    default:
+      return SYMBOL_FILTER_KEEP;
+    }
+
+  if (symbol->ident == NULL || symbol->ident[0] == '_')
+    return SYMBOL_FILTER_DROP;
+
+  if (scanner->symbol_prefixes == NULL || scanner->ucase_symbol_prefixes == NULL)
+    return SYMBOL_FILTER_KEEP;
+
+  if (g_ascii_isupper (symbol->ident[0]))
+    prefixes = scanner->ucase_symbol_prefixes;
+  else
+    prefixes = scanner->symbol_prefixes;
+
+  for (; *prefixes; prefixes++)
+    {
+      if (g_str_has_prefix (symbol->ident, *prefixes))
+        return SYMBOL_FILTER_KEEP;
+    }
+
+  return SYMBOL_FILTER_STUB;
 }
 
 gboolean
@@ -268,6 +445,8 @@ void
 gi_source_scanner_add_symbol (GISourceScanner  *scanner,
 			      GISourceSymbol   *symbol)
 {
+  gboolean foreign;
+
   if (scanner->skipping)
     {
       g_debug ("skipping symbol due to __GI_SCANNER__ cond: %s", symbol->ident);
@@ -276,7 +455,8 @@ gi_source_scanner_add_symbol (GISourceScanner  *scanner,
 
   g_assert (scanner->current_file);
 
-  if (scanner->macro_scan || g_hash_table_contains (scanner->files, scanner->current_file))
+  foreign = !g_hash_table_contains (scanner->files, scanner->current_file);
+  if (scanner->macro_scan || !foreign)
     scanner->symbols = g_slist_prepend (scanner->symbols,
                                         gi_source_symbol_ref (symbol));
 
@@ -288,6 +468,9 @@ gi_source_scanner_add_symbol (GISourceScanner  *scanner,
       g_hash_table_insert (scanner->typedef_table,
 			   g_strdup (symbol->ident),
 			   GINT_TO_POINTER (TRUE));
+      if (!scanner->macro_scan)
+        g_hash_table_insert (scanner->declared_typedefs, g_strdup (symbol->ident),
+                             gi_source_symbol_ref (symbol));
       break;
     default:
       break;
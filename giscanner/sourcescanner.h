@@ -97,6 +97,13 @@ typedef enum
   UNARY_LOGICAL_NEGATION
 } UnaryOperator;
 
+typedef enum
+{
+  SYMBOL_FILTER_KEEP,
+  SYMBOL_FILTER_STUB, /* only its name and location are needed */
+  SYMBOL_FILTER_DROP
+} SymbolFilterResult;
+
 struct _GISourceComment
 {
   char *comment;
@@ -116,6 +123,27 @@ struct _GISourceScanner
   GHashTable *typedef_table;
   gboolean skipping;
   GQueue conditionals;
+  FILE *macros; /* directives found by gi_source_scanner_scan_macros */
+  /* Declarations of the files parsed by a previous scan, see
+   * gi_source_scanner_set_baseline() */
+  gboolean use_baseline;
+  gboolean in_foreign_file;
+  gboolean in_baseline_file;
+  GHashTable *parsed_files;
+  GHashTable *declared_typedefs;
+  GHashTable *declared_constants;
+  GHashTable *baseline_files;
+  /* Where yylex() is in the token stream, reset for each file parsed */
+  int lex_depth;
+  int lex_last_token;
+  gboolean lex_dropping;
+  /* See gi_source_scanner_set_symbol_filter() */
+  gboolean filter_symbols;
+  char **symbol_prefixes;
+  char **ucase_symbol_prefixes;
+  /* Interned file names, see gi_source_scanner_get_file_id() */
+  GHashTable *file_ids;
+  GPtrArray *filenames;
 };
 
 struct _GISourceSymbol
@@ -156,8 +184,25 @@ gboolean            gi_source_scanner_parse_file       (GISourceScanner  *igener
 						        FILE             *file);
 void                gi_source_scanner_parse_macros     (GISourceScanner  *scanner,
 							GList            *filenames);
+void                gi_source_scanner_scan_macros      (GISourceScanner  *scanner,
+							const gchar      *filename,
+							gboolean          comments);
+void                gi_source_scanner_parse_scanned_macros (GISourceScanner *scanner);
+gboolean            gi_source_scanner_scan_comments    (GISourceScanner  *scanner,
+							const gchar      *filename);
+void                gi_source_scanner_set_baseline     (GISourceScanner  *scanner,
+							GList            *filenames,
+							GList            *typedefs,
+							GList            *constants);
+void                gi_source_scanner_set_symbol_filter (GISourceScanner *scanner,
+							 char           **symbol_prefixes,
+							 char           **ucase_symbol_prefixes);
+SymbolFilterResult  gi_source_scanner_filter_symbol    (GISourceScanner  *scanner,
+							GISourceSymbol   *symbol);
 void                gi_source_scanner_set_macro_scan   (GISourceScanner  *scanner,
 							gboolean          macro_scan);
+int                 gi_source_scanner_get_file_id      (GISourceScanner  *scanner,
+							const char       *filename);
 GSList *            gi_source_scanner_get_symbols      (GISourceScanner  *scanner);
 GSList *            gi_source_scanner_get_comments     (GISourceScanner  *scanner);
 void                gi_source_scanner_free             (GISourceScanner  *scanner);
@@ -19,12 +19,16 @@
 #
 
 from __future__ import with_statement
+import hashlib
 import os
+import re
 import subprocess
 import tempfile
+from distutils.errors import CompileError
+from multiprocessing.pool import ThreadPool
 
 from .libtoolimporter import LibtoolImporter
-from .message import Position
+from .message import Position, get_filename, intern_filename
 from .ccompiler import CCompiler
 
 with LibtoolImporter(None, None):
@@ -112,12 +116,9 @@ def ctype_name(ctype):
 
 
 class SourceType(object):
-    __members__ = ['type', 'base_type', 'name', 'type_qualifier',
-                   'child_list', 'is_bitfield']
-
-    def __init__(self, scanner, stype):
-        self._scanner = scanner
-        self._stype = stype
+    __slots__ = ['type', 'storage_class_specifier', 'type_qualifier',
+                 'function_specifier', 'name', 'base_type', 'child_list',
+                 'is_bitfield']
 
     def __repr__(self):
         return '<%s type=%r name=%r>' % (
@@ -125,42 +126,25 @@ class SourceType(object):
             ctype_name(self.type),
             self.name)
 
-    @property
-    def type(self):
-        return self._stype.type
-
-    @property
-    def base_type(self):
-        if self._stype.base_type is not None:
-            return SourceType(self._scanner, self._stype.base_type)
-
-    @property
-    def name(self):
-        return self._stype.name
-
-    @property
-    def type_qualifier(self):
-        return self._stype.type_qualifier
-
-    @property
-    def child_list(self):
-        for symbol in self._stype.child_list:
-            if symbol is None:
-                continue
-            yield SourceSymbol(self._scanner, symbol)
-
-    @property
-    def is_bitfield(self):
-        return self._stype.is_bitfield
-
 
 class SourceSymbol(object):
-    __members__ = ['const_int', 'const_double', 'const_string', 'const_boolean',
-                   'ident', 'type', 'base_type']
-
-    def __init__(self, scanner, symbol):
-        self._scanner = scanner
-        self._symbol = symbol
+    __slots__ = ['type', 'ident', 'base_type', 'const_int', 'const_double',
+                 'const_string', 'const_boolean', 'file_id', 'line',
+                 'private']
+
+    def __getstate__(self):
+        # File IDs are only valid in the current process
+        state = dict((name, getattr(self, name)) for name in self.__slots__
+                     if name != 'file_id')
+        state['source_filename'] = self.source_filename
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        filename = state.pop('source_filename')
+        self.file_id = intern_filename(filename) if filename is not None else None
+        for name, value in state.iteritems():
+            setattr(self, name, value)
 
     def __repr__(self):
         src = self.source_filename
@@ -175,50 +159,62 @@ class SourceSymbol(object):
             src)
 
     @property
-    def const_int(self):
-        return self._symbol.const_int
+    def source_filename(self):
+        if self.file_id is None:
+            return None
+        return get_filename(self.file_id)
 
     @property
-    def const_double(self):
-        return self._symbol.const_double
+    def position(self):
+        return Position(self.file_id, self.line)
 
-    @property
-    def const_string(self):
-        return self._symbol.const_string
 
-    @property
-    def const_boolean(self):
-        return self._symbol.const_boolean
+def _load_symbol_table(table, file_ids):
+    # The C scanner exports its symbols and their types as flat tuples
+    # which refer to each other by index, -1 standing for None.  The
+    # symbols dropped by the symbol filter are None, the files are
+    # indexes in file_ids.
+    symbol_records, type_records, roots = table
+    symbols = [SourceSymbol() for record in symbol_records]
+    types = [SourceType() for record in type_records]
 
-    @property
-    def ident(self):
-        return self._symbol.ident
+    for stype, record in zip(types, type_records):
+        (stype.type, stype.storage_class_specifier, stype.type_qualifier,
+         stype.function_specifier, stype.name, base_type, child_list,
+         stype.is_bitfield) = record
+        stype.base_type = types[base_type] if base_type >= 0 else None
+        stype.child_list = [symbols[child] for child in child_list if child >= 0]
 
-    @property
-    def type(self):
-        return self._symbol.type
+    for symbol, record in zip(symbols, symbol_records):
+        (symbol.type, symbol.ident, base_type, symbol.const_int,
+         symbol.const_double, symbol.const_string, symbol.const_boolean,
+         file_id, symbol.line, symbol.private) = record
+        symbol.base_type = types[base_type] if base_type >= 0 else None
+        symbol.file_id = file_ids[file_id] if file_id >= 0 else None
 
-    @property
-    def base_type(self):
-        if self._symbol.base_type is not None:
-            return SourceType(self._scanner, self._symbol.base_type)
+    return [symbols[index] if index >= 0 else None for index in roots]
 
-    @property
-    def source_filename(self):
-        return self._symbol.source_filename
 
-    @property
-    def line(self):
-        return self._symbol.line
+def _get_file_digest(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
 
-    @property
-    def private(self):
-        return self._symbol.private
 
-    @property
-    def position(self):
-        return Position(self._symbol.source_filename,
-                        self._symbol.line)
+_INCLUDE_RE = re.compile(r'^[ \t]*#[ \t]*include[ \t]*[<"]([^>"]+)[>"]', re.MULTILINE)
+
+
+def _intern_comments(comments):
+    # The cached comments have file names, the scanner file IDs
+    return [(comment, intern_filename(filename), line)
+            for comment, filename, line in comments]
+
+
+def _scan_header(filename):
+    # The digest of a header and the names of the files it includes,
+    # whether they are included or not depending on the conditionals
+    with open(filename, 'rb') as f:
+        data = f.read()
+    return hashlib.sha1(data).hexdigest(), _INCLUDE_RE.findall(data)
 
 
 class SourceScanner(object):
@@ -227,9 +223,53 @@ class SourceScanner(object):
         self._scanner = CSourceScanner()
         self._filenames = []
         self._cpp_options = []
+        self._jobs = 1
+        self._macro_filenames = set()
+        self._shard_bounds = []
+        self._cachestore = None
+        self._header_cache = None
+        self._comment_cache = None
+        # Replacements of the symbols and comments of the C scanner by
+        # cached ones, as (start, end, items)
+        self._edits = ([], [])
+        self._file_ids = []
+        # Prefixes given to set_symbol_filter(), or None
+        self._symbol_filter = None
 
     # Public API
 
+    def set_baseline_cache(self, cachestore):
+        """Keep the typedefs and enumerations declared by the headers which
+are not scanned in cachestore, so that the next scans with the same
+headers and preprocessor options do not parse them again."""
+        self._cachestore = cachestore
+
+    def set_header_cache(self, cachestore):
+        """Keep the symbols and comments of each scanned header in
+cachestore, so that the next scans with the same preprocessor options
+only parse the headers which changed, or which include headers which
+changed.  This implies set_baseline_cache()."""
+        self._header_cache = cachestore
+
+    def set_comment_cache(self, cachestore):
+        """Keep the comments of each source file in cachestore, so that
+the next scans only read the source files which changed.  The macros of
+the source files are not parsed then, only the constants of the
+headers are used."""
+        self._comment_cache = cachestore
+
+    def set_symbol_filter(self, symbol_prefixes=None, ucase_symbol_prefixes=None):
+        """Do not export the symbols the transformer ignores from the C
+scanner: variables, private functions and constants, and constants
+which are not declared in a header.  If the prefixes of the functions
+and constants of the namespace are given, the other ones are only
+exported with their name and location."""
+        self._scanner.set_symbol_filter(symbol_prefixes, ucase_symbol_prefixes)
+        self._symbol_filter = (symbol_prefixes, ucase_symbol_prefixes)
+
+    def set_jobs(self, jobs):
+        self._jobs = max(jobs, 1)
+
     def set_cpp_options(self, includes, defines, undefines, cflags=[]):
         self._cpp_options.extend(cflags)
         for prefix, args in [('-I', [os.path.realpath(f) for f in includes]),
@@ -248,26 +288,59 @@ class SourceScanner(object):
             self._filenames.append(filename)
 
         headers = []
+        sources = []
         for filename in self._filenames:
-            if os.path.splitext(filename)[1] in SOURCE_EXTS:
+            # Each file is read once for the macros parse_macros() needs,
+            # and for the comments of the source files
+            is_source = os.path.splitext(filename)[1] in SOURCE_EXTS
+            if is_source and self._comment_cache is not None:
+                sources.append(filename)
+            elif filename not in self._macro_filenames:
+                self._scanner.scan_macros(filename, is_source)
+                self._macro_filenames.add(filename)
+            elif is_source:
                 self._scanner.lex_filename(filename)
-            else:
+            if not is_source:
                 headers.append(filename)
 
+        if sources:
+            self._lex_sources(sources)
         self._parse(headers)
 
     def parse_macros(self, filenames):
         self._scanner.set_macro_scan(True)
-        # self._scanner expects file names to be canonicalized and symlinks to be resolved
-        self._scanner.parse_macros([os.path.realpath(f) for f in filenames])
+        for filename in filenames:
+            # self._scanner expects file names to be canonicalized and symlinks to be resolved
+            filename = os.path.realpath(filename)
+            if filename not in self._macro_filenames:
+                self._scanner.scan_macros(filename, False)
+        self._scanner.parse_scanned_macros()
+        self._macro_filenames = set()
         self._scanner.set_macro_scan(False)
 
+    def parse_comments(self, filenames):
+        # Only the comments are read, the files are not preprocessed
+        # and get_symbols() stays empty
+        for filename in filenames:
+            filename = os.path.realpath(filename)
+            self._scanner.append_filename(filename)
+            self._scanner.scan_comments(filename)
+
     def get_symbols(self):
-        for symbol in self._scanner.get_symbols():
-            yield SourceSymbol(self._scanner, symbol)
+        table = self._scanner.get_symbol_table()
+        symbols = _load_symbol_table(table, self._get_file_ids())
+        symbols = self._apply_edits(symbols, 0, self._get_symbol_key,
+                                    self._filter_symbol)
+        for symbol in symbols:
+            if symbol is not None:
+                yield symbol
 
     def get_comments(self):
-        return self._scanner.get_comments()
+        comments = self._scanner.get_comments()
+        file_ids = self._get_file_ids()
+        comments = [(comment, file_ids[file_id], line)
+                    for comment, file_id, line in comments]
+        return self._apply_edits(comments, 1, lambda comment: comment)
 
     def dump(self):
         print '-' * 30
@@ -280,15 +353,305 @@ class SourceScanner(object):
         if not filenames:
             return
 
-        defines = ['__GI_SCANNER__']
-        undefs = []
+        if self._header_cache is not None:
+            self._parse_incremental(filenames)
+            return
 
+        if self._cachestore is None:
+            self._parse_headers(filenames)
+            return
+
+        key = self._get_baseline_key()
+        baseline = self._load_baseline(self._cachestore, key)
+        if baseline is not None:
+            self._scanner.set_baseline(list(baseline['files']),
+                                       baseline['typedefs'],
+                                       baseline['constants'])
+        self._parse_headers(filenames)
+        self._store_baseline(self._cachestore, key, baseline)
+
+    def _get_cpp_key(self):
+        # What the preprocessor outputs depends on its options, and on the
+        # current directory which is in the include path
         cc = CCompiler()
+        key = [os.getcwd(), cc.compiler_cmd]
+        key.extend(getattr(cc.compiler, 'preprocessor', None) or [])
+        key.extend(self._cpp_options)
+        return '\0'.join(key)
+
+    def _get_baseline_key(self):
+        # The foreign files are the ones which are not scanned
+        return '\0'.join(['baseline', self._get_cpp_key()] + sorted(self._filenames))
+
+    def _load_baseline(self, cachestore, key):
+        baseline = cachestore.load_data(key)
+        if baseline is None:
+            return None
+
+        for filename, digest in baseline['files'].iteritems():
+            try:
+                if _get_file_digest(filename) != digest:
+                    return None
+            except IOError:
+                return None
+        return baseline
+
+    def _store_baseline(self, cachestore, key, baseline):
+        filenames, typedefs, constants = self._scanner.get_baseline()
+        # The preprocessor input and its built-in files are not files
+        # which can change
+        scanned = set(self._filenames)
+        filenames = set(filename for filename in filenames
+                        if os.path.isfile(filename) and filename not in scanned)
+        if baseline is not None:
+            # The files skipped thanks to the baseline may not have been
+            # included this time
+            previous = set(baseline['files']) - scanned
+            if filenames <= previous:
+                return
+            filenames |= previous
+
+        files = {}
+        for filename in filenames:
+            files[filename] = _get_file_digest(filename)
+        typedefs = [typedef for typedef in typedefs if typedef[1] in files]
+        constants = [constant for constant in constants if constant[3] in files]
+        cachestore.store_data(key, {'files': files,
+                                    'typedefs': sorted(typedefs),
+                                    'constants': sorted(constants)})
+
+    def _parse_incremental(self, filenames):
+        cpp_key = self._get_cpp_key()
+        keys, order = self._scan_headers(cpp_key, filenames)
+        scanned = set(self._filenames)
+
+        # The headers are only parsed again if the foreign files they
+        # include did not change, as tracked by the baseline
+        index_key = 'headers\0' + cpp_key
+        baseline = self._load_baseline(self._header_cache, index_key)
+        cached = {}
+        if baseline is not None:
+            for filename in filenames:
+                entry = self._header_cache.load_data(keys[filename])
+                if entry is not None:
+                    cached[filename] = entry
+
+            files = [filename for filename in baseline['files']
+                     if filename not in scanned]
+            files.extend(cached)
+            typedefs = [typedef for typedef in baseline['typedefs']
+                        if typedef[1] not in scanned]
+            constants = [constant for constant in baseline['constants']
+                         if constant[3] not in scanned]
+            for entry in cached.itervalues():
+                typedefs.extend(entry['typedefs'])
+                constants.extend(entry['constants'])
+            self._scanner.set_baseline(files, typedefs, constants)
+
+        changed = [filename for filename in filenames if filename not in cached]
+        start = self._get_scanner_bounds()
+        if changed:
+            self._parse_headers(changed)
+        end = self._get_scanner_bounds()
+
+        parsed = self._split_headers(changed, start, end)
+        for filename in changed:
+            self._header_cache.store_data(keys[filename], parsed[filename])
+        self._store_baseline(self._header_cache, index_key, baseline)
+
+        symbols = []
+        comments = []
+        for filename in order:
+            entry = cached[filename] if filename in cached else parsed[filename]
+            symbols.extend(entry['symbols'])
+            comments.extend(entry['comments'])
+        self._edits[0].append((start[0], end[0], symbols))
+        self._edits[1].append((start[1], end[1], _intern_comments(comments)))
+
+    def _scan_headers(self, cpp_key, filenames):
+        # A header is parsed again when it changes, or when one of the
+        # scanned headers it includes, directly or not, changes.  The
+        # included names are matched on their base name only, which at
+        # worst adds dependencies.
+        digests = {}
+        names = {}
+        by_basename = {}
+        for filename in filenames:
+            digests[filename], names[filename] = _scan_header(filename)
+            by_basename.setdefault(os.path.basename(filename), []).append(filename)
 
-        tmp_fd_cpp, tmp_name_cpp = tempfile.mkstemp(prefix='g-ir-cpp-', suffix='.c')
-        fp_cpp = os.fdopen(tmp_fd_cpp, 'w')
-        self._write_preprocess_src(fp_cpp, defines, undefs, filenames)
-        fp_cpp.close()
+        includes = {}
+        for filename in filenames:
+            includes[filename] = []
+            for name in names[filename]:
+                includes[filename].extend(by_basename.get(os.path.basename(name), []))
+
+        keys = {}
+        for filename in filenames:
+            deps = set()
+            pending = [filename]
+            while pending:
+                for dep in includes[pending.pop()]:
+                    if dep not in deps:
+                        deps.add(dep)
+                        pending.append(dep)
+            deps.discard(filename)
+            key = ['header', cpp_key, filename, digests[filename]]
+            for dep in sorted(deps):
+                key.extend([dep, digests[dep]])
+            keys[filename] = '\0'.join(key)
+
+        # The headers are reported after the headers they include, as the
+        # preprocessor would see them if the includes are at the top
+        order = []
+        visited = set()
+
+        def visit(filename):
+            if filename in visited:
+                return
+            visited.add(filename)
+            for dep in includes[filename]:
+                visit(dep)
+            order.append(filename)
+
+        for filename in filenames:
+            visit(filename)
+        return keys, order
+
+    def _split_headers(self, filenames, start, end):
+        # Sort what the C scanner found between the start and end bounds
+        # by header; headers parsed by several shards are only kept once
+        parsed = {}
+        for filename in filenames:
+            parsed[filename] = {'symbols': [], 'comments': [],
+                                'typedefs': [], 'constants': []}
+
+        seen = set()
+        # The cached symbols do not depend on the symbol filter, it is
+        # applied by get_symbols()
+        table = self._scanner.get_symbol_table(False)
+        symbols = _load_symbol_table(table, self._get_file_ids())
+        for symbol in symbols[start[0]:end[0]]:
+            key = self._get_symbol_key(symbol)
+            if symbol.source_filename in parsed and key not in seen:
+                parsed[symbol.source_filename]['symbols'].append(symbol)
+                seen.add(key)
+
+        seen = set()
+        comments = self._scanner.get_comments()[start[1]:end[1]]
+        filenames = self._scanner.get_filenames()
+        for comment, file_id, line in comments:
+            comment = (comment, filenames[file_id], line)
+            if comment[1] in parsed and comment not in seen:
+                parsed[comment[1]]['comments'].append(comment)
+                seen.add(comment)
+
+        _, typedefs, constants = self._scanner.get_baseline()
+        for typedef in typedefs:
+            if typedef[1] in parsed:
+                parsed[typedef[1]]['typedefs'].append(typedef)
+        for constant in constants:
+            if constant[3] in parsed:
+                parsed[constant[3]]['constants'].append(constant)
+        return parsed
+
+    def _lex_sources(self, filenames):
+        # The comments of a source file only depend on its contents, the
+        # cached ones are inserted where the C scanner would have had them
+        missed = []
+        for filename in filenames:
+            key = '\0'.join(['comments', filename, _get_file_digest(filename)])
+            comments = self._comment_cache.load_data(key)
+            bound = self._get_scanner_bounds()[1]
+            if comments is None:
+                self._scanner.lex_filename(filename)
+                missed.append((key, bound, self._get_scanner_bounds()[1]))
+            else:
+                self._edits[1].append((bound, bound, _intern_comments(comments)))
+            # parse_macros() does not need to read it either
+            self._macro_filenames.add(filename)
+
+        if not missed:
+            return
+        comments = self._scanner.get_comments()
+        filenames = self._scanner.get_filenames()
+        for key, start, end in missed:
+            self._comment_cache.store_data(
+                key, [(comment, filenames[file_id], line)
+                      for comment, file_id, line in comments[start:end]])
+
+    def _apply_edits(self, items, index, get_key, filter_item=None):
+        # The header cache replaces the parse of all the shards
+        if self._header_cache is None:
+            items = self._merge_shards(items, index, get_key)
+        # The bounds of the edits are indexes in the items of the C
+        # scanner, the last ones are applied first.  Edits at the same
+        # bounds are applied from the last added, so that their items
+        # end up in the order they were added.
+        edits = sorted([(start, end, position, edit_items)
+                        for position, (start, end, edit_items)
+                        in enumerate(self._edits[index])],
+                       reverse=True)
+        for start, end, position, edit_items in edits:
+            if filter_item is not None:
+                edit_items = map(filter_item, edit_items)
+            items = items[:start] + edit_items + items[end:]
+        return items
+
+    def _parse_headers(self, filenames):
+        jobs = min(self._jobs, len(filenames))
+        if jobs == 1:
+            cc = CCompiler()
+            if cc.check_can_preprocess_to_pipe():
+                self._parse_pipe(cc, filenames)
+            else:
+                self._parse_preprocessed(self._preprocess((cc, filenames)))
+            return
+
+        # Split the headers into contiguous shards, so that the first time a
+        # header is seen in shard order is where a single preprocessor run
+        # would have included it
+        size = (len(filenames) + jobs - 1) // jobs
+        shards = [filenames[i:i + size] for i in range(0, len(filenames), size)]
+
+        self._shard_bounds = [self._get_scanner_bounds()]
+        pool = ThreadPool(len(shards))
+        try:
+            # The parser is not reentrant, the shards are parsed in order
+            # while the preprocessor runs on the following ones
+            for output in pool.imap(self._preprocess,
+                                    [(CCompiler(), shard) for shard in shards]):
+                self._parse_preprocessed(output)
+                self._shard_bounds.append(self._get_scanner_bounds())
+                # The declarations of the headers parsed by a shard are
+                # skipped by the following ones, as a single preprocessor
+                # run would not have included them again; parsing a typedef
+                # twice is a syntax error
+                self._scanner.set_baseline(self._scanner.get_baseline()[0], [], [])
+        finally:
+            pool.close()
+            pool.join()
+
+    def _parse_pipe(self, cc, filenames):
+        # The parser reads the output of the preprocessor as it is produced,
+        # it never touches the disk
+        tmp_name_cpp = self._write_preprocess_file(filenames)
+        try:
+            proc = cc.preprocess_to_pipe(tmp_name_cpp, self._cpp_options)
+            try:
+                self._scanner.parse_file(proc.stdout.fileno())
+            finally:
+                proc.stdout.close()
+                returncode = proc.wait()
+        finally:
+            os.unlink(tmp_name_cpp)
+
+        if returncode != 0:
+            raise CompileError("preprocessor exited with status %d" % (returncode, ))
+
+    def _preprocess(self, args):
+        cc, filenames = args
+        tmp_name_cpp = self._write_preprocess_file(filenames)
 
         tmpfile_basename = os.path.basename(os.path.splitext(tmp_name_cpp)[0])
 
@@ -296,16 +659,100 @@ class SourceScanner(object):
         # so we want the name to match the output file name of the MSVC preprocessor
         tmpfile_output = tmpfile_basename + '.i'
 
-        cc.preprocess(tmp_name_cpp,
-                      tmpfile_output,
-                      self._cpp_options)
+        try:
+            cc.preprocess(tmp_name_cpp,
+                          tmpfile_output,
+                          self._cpp_options)
+        finally:
+            os.unlink(tmp_name_cpp)
+        return tmpfile_output
 
-        os.unlink(tmp_name_cpp)
-        fp = open(tmpfile_output, 'r')
+    def _parse_preprocessed(self, filename):
+        fp = open(filename, 'r')
 
         self._scanner.parse_file(fp.fileno())
         fp.close()
-        os.unlink(tmpfile_output)
+        os.unlink(filename)
+
+    def _get_scanner_bounds(self):
+        return self._scanner.get_bounds()
+
+    def _get_symbol_key(self, symbol):
+        if symbol is None:
+            return None
+        return (symbol.type, symbol.ident, symbol.file_id, symbol.line)
+
+    def _filter_symbol(self, symbol):
+        # The same as gi_source_scanner_filter_symbol() for the symbols
+        # which did not come from the C scanner: returns the symbol,
+        # a stub of it or None if it is dropped
+        if self._symbol_filter is None or symbol is None:
+            return symbol
+        if symbol.type == CSYMBOL_TYPE_OBJECT:
+            return None
+        elif symbol.type == CSYMBOL_TYPE_CONST:
+            # Constants are only public when they come from a header
+            filename = symbol.source_filename
+            if filename is None or not filename.endswith('.h'):
+                return None
+        elif symbol.type != CSYMBOL_TYPE_FUNCTION:
+            return symbol
+
+        if not symbol.ident or symbol.ident[0] == '_':
+            return None
+
+        symbol_prefixes, ucase_symbol_prefixes = self._symbol_filter
+        if symbol_prefixes is None or ucase_symbol_prefixes is None:
+            return symbol
+        if symbol.ident[0].isupper():
+            prefixes = ucase_symbol_prefixes
+        else:
+            prefixes = symbol_prefixes
+        for prefix in prefixes:
+            if symbol.ident.startswith(prefix):
+                return symbol
+
+        stub = SourceSymbol()
+        for name in SourceSymbol.__slots__:
+            setattr(stub, name, getattr(symbol, name))
+        stub.base_type = None
+        stub.const_int = stub.const_double = None
+        stub.const_string = stub.const_boolean = None
+        return stub
+
+    def _get_file_ids(self):
+        # The file IDs of the files known to the C scanner, by index
+        filenames = self._scanner.get_filenames()
+        self._file_ids.extend(intern_filename(filename)
+                              for filename in filenames[len(self._file_ids):])
+        return self._file_ids
+
+    def _merge_shards(self, items, index, get_key):
+        # The comments of the headers included from more than one shard are
+        # found by each of them, only keep the items from the first shard
+        # which saw them
+        if len(self._shard_bounds) < 3:
+            return items
+
+        bounds = [bound[index] for bound in self._shard_bounds]
+        merged = items[:bounds[1]]
+        seen = set(get_key(item) for item in items[bounds[0]:bounds[1]])
+        for start, end in zip(bounds[1:-1], bounds[2:]):
+            shard = items[start:end]
+            merged.extend(item for item in shard if get_key(item) not in seen)
+            seen.update(get_key(item) for item in shard)
+        merged.extend(items[bounds[-1]:])
+        return merged
+
+    def _write_preprocess_file(self, filenames):
+        defines = ['__GI_SCANNER__']
+        undefs = []
+
+        tmp_fd_cpp, tmp_name_cpp = tempfile.mkstemp(prefix='g-ir-cpp-', suffix='.c')
+        fp_cpp = os.fdopen(tmp_fd_cpp, 'w')
+        self._write_preprocess_src(fp_cpp, defines, undefs, filenames)
+        fp_cpp.close()
+        return tmp_name_cpp
 
     def _write_preprocess_src(self, fp, defines, undefs, filenames):
         # Write to the temp file for feeding into the preprocessor
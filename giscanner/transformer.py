@@ -41,27 +41,205 @@ class TransformerException(Exception):
     pass
 
 
+# The GIR files of each directory of the search path, which is only
+# listed once per process
+_gir_listings = {}
+
+
+def _list_gir_files(directory):
+    listing = _gir_listings.get(directory)
+    if listing is None:
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []
+        listing = [name for name in names if name.endswith('.gir')]
+        _gir_listings[directory] = listing
+    return listing
+
+
+class _FilterCommand(object):
+    """Run names through a filter shell command.  With the 'oneshot'
+protocol, the command is started for each name, which it reads until
+the end of its input.  With the 'lines' protocol, it is started once and
+is expected to answer each line written to its input with one line."""
+
+    def __init__(self, cmd, protocol='oneshot'):
+        self._cmd = cmd
+        self._protocol = protocol
+        self._proc = None
+
+    def filter(self, name):
+        if self._protocol == 'lines':
+            return self._filter_line(name)
+
+        proc = subprocess.Popen(self._cmd,
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                shell=True)
+        name, err = proc.communicate(name)
+        if proc.returncode:
+            raise ValueError('filter: "%s" exited: %d with error: %s' %
+                             (self._cmd, proc.returncode, err))
+        return name
+
+    def _filter_line(self, name):
+        if self._proc is None:
+            self._proc = subprocess.Popen(self._cmd,
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          shell=True)
+        try:
+            self._proc.stdin.write(name + '\n')
+            self._proc.stdin.flush()
+            line = self._proc.stdout.readline()
+        except IOError:
+            line = ''
+        if not line.endswith('\n'):
+            # The command exited, or closed its output
+            self._proc.stdin.close()
+            returncode = self._proc.wait()
+            self._proc = None
+            raise ValueError('filter: "%s" exited: %d without filtering %r' %
+                             (self._cmd, returncode, name))
+        return line[:-1]
+
+
+class _PrefixTree(object):
+    """A trie of string prefixes, each associated with values."""
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, prefix, value):
+        node = self._root
+        for c in prefix:
+            node = node.setdefault(c, {})
+        node.setdefault(None, []).append(value)
+
+    def iter_matches(self, string):
+        """Yield (prefix_length, values) for each prefix of string in
+the tree, shortest first."""
+        node = self._root
+        length = 0
+        while True:
+            values = node.get(None)
+            if values is not None:
+                yield length, values
+            if length == len(string):
+                return
+            node = node.get(string[length])
+            if node is None:
+                return
+            length += 1
+
+
+class _PendingNamespace(ast.Namespace):
+    """The namespace of an included GIR file of which only the header
+was parsed, so that its prefixes and includes are known.  As soon as
+its nodes are needed, load() is called, which should also replace it
+with the namespace it returns wherever it was registered.  References
+kept elsewhere still work: it takes the class of that namespace and
+shares its attributes."""
+
+    def __init__(self, header, load):
+        self.__dict__.update(header.__dict__)
+        for table in ('names', 'aliases', 'type_names', 'ctypes', 'symbols'):
+            del self.__dict__[table]
+        self._load_namespace = load
+
+    def _load(self):
+        namespace = self._load_namespace()
+        self.__class__ = namespace.__class__
+        self.__dict__ = namespace.__dict__
+
+    def __getattr__(self, attr):
+        # Only called for the attributes the header does not have
+        if attr.startswith('__') or attr == '_load_namespace':
+            raise AttributeError(attr)
+        self._load()
+        return getattr(self, attr)
+
+    def __iter__(self):
+        self._load()
+        return iter(self)
+
+    def __contains__(self, name):
+        self._load()
+        return name in self
+
+    def iteritems(self):
+        self._load()
+        return self.iteritems()
+
+    def itervalues(self):
+        self._load()
+        return self.itervalues()
+
+    def get(self, name):
+        self._load()
+        return self.get(name)
+
+    def get_by_ctype(self, ctype):
+        self._load()
+        return self.get_by_ctype(ctype)
+
+    def get_by_symbol(self, symbol):
+        self._load()
+        return self.get_by_symbol(symbol)
+
+    def get_by_gtype_name(self, gtype_name):
+        self._load()
+        return self.get_by_gtype_name(gtype_name)
+
+
 class Transformer(object):
     namespace = property(lambda self: self._namespace)
 
     def __init__(self, namespace, accept_unprefixed=False,
-                 identifier_filter_cmd='', symbol_filter_cmd=''):
+                 identifier_filter_cmd='', symbol_filter_cmd='',
+                 filter_cmd_protocol='oneshot'):
         self._cachestore = CacheStore()
         self._accept_unprefixed = accept_unprefixed
         self._namespace = namespace
         self._pkg_config_packages = set()
         self._typedefs_ns = {}
         self._parsed_includes = {}  # <string namespace -> Namespace>
+        self._prefix_trees = None
+        # Results of the namespace matching of names, or the exceptions
+        # raised, valid until the includes change
+        self._split_cache = {}
+        self._strip_cache = {}
+        self._name_cache_hits = {'split': 0, 'strip': 0}
+        self._name_cache_misses = {'split': 0, 'strip': 0}
         self._includepaths = []
+        self._gir_search_path = None
+        self._gir_index = None  # <GIR file name -> path>
         self._passthrough_mode = False
-        self._identifier_filter_cmd = identifier_filter_cmd
-        self._symbol_filter_cmd = symbol_filter_cmd
+        self._lazy_includes = False
+        self._identifier_filter = None
+        self._symbol_filter = None
+        if identifier_filter_cmd:
+            self._identifier_filter = _FilterCommand(identifier_filter_cmd,
+                                                     filter_cmd_protocol)
+        if symbol_filter_cmd:
+            self._symbol_filter = _FilterCommand(symbol_filter_cmd, filter_cmd_protocol)
 
         # Cache a list of struct/unions in C's "tag namespace". This helps
         # manage various orderings of typedefs and structs. See:
         # https://bugzilla.gnome.org/show_bug.cgi?id=581525
         self._tag_ns = {}
 
+    def format_name_cache_statistics(self):
+        lines = ['g-ir-scanner name cache statistics:']
+        for kind, label in [('split', 'namespace splits'), ('strip', 'stripped identifiers')]:
+            hits = self._name_cache_hits[kind]
+            lookups = hits + self._name_cache_misses[kind]
+            lines.append('  %s: %d hits out of %d lookups (%.1f%%)' % (
+                label, hits, lookups, 100.0 * hits / lookups if lookups else 0.0))
+        return '\n'.join(lines) + '\n'
+
     def get_pkgconfig_packages(self):
         return self._pkg_config_packages
 
@@ -71,6 +249,11 @@ class Transformer(object):
     def set_passthrough_mode(self):
         self._passthrough_mode = True
 
+    def set_lazy_includes(self):
+        """Only parse the headers of the included GIR files, their nodes
+are loaded once they are looked up."""
+        self._lazy_includes = True
+
     def _append_new_node(self, node):
         original = self._namespace.get(node.name)
         # Special case constants here; we allow duplication to sort-of
@@ -127,6 +310,30 @@ class Transformer(object):
 
     def set_include_paths(self, paths):
         self._includepaths = list(paths)
+        self._gir_search_path = None
+        self._gir_index = None
+
+    def get_gir_search_path(self):
+        """Return the directories which are searched for included GIR
+files, in order of precedence."""
+        if self._gir_search_path is None:
+            searchdirs = self._includepaths[:]
+            for path in self._get_gi_data_dirs():
+                searchdirs.append(os.path.join(path, 'gir-1.0'))
+            searchdirs.append(os.path.join(DATADIR, 'gir-1.0'))
+            self._gir_search_path = searchdirs
+        return self._gir_search_path[:]
+
+    def load_gir(self, filename):
+        """Return the namespace of the GIR file filename, loaded from the
+cache if possible, without registering it or its includes."""
+        if self._cachestore is not None:
+            # Both kinds of namespaces are cached separately, so that
+            # g-ir-doc-tool and the scanner don't replace each other's
+            # entries.
+            variant = 'full' if self._passthrough_mode else 'types'
+            return self._cachestore.load_or_create(filename, self._parse_gir, variant)
+        return self._parse_gir(filename)
 
     def register_include(self, include):
         if include in self._namespace.includes:
@@ -184,17 +391,21 @@ None."""
             data_dirs.append('/usr/share')
         return data_dirs
 
-    def _find_include(self, include):
-        searchdirs = self._includepaths[:]
-        for path in self._get_gi_data_dirs():
-            searchdirs.append(os.path.join(path, 'gir-1.0'))
-        searchdirs.append(os.path.join(DATADIR, 'gir-1.0'))
+    def _get_gir_index(self):
+        if self._gir_index is None:
+            self._gir_index = {}
+            for d in self.get_gir_search_path():
+                for girname in _list_gir_files(d):
+                    # The first directories take precedence
+                    self._gir_index.setdefault(girname, os.path.join(d, girname))
+        return self._gir_index
 
+    def _find_include(self, include):
         girname = '%s-%s.gir' % (include.name, include.version)
-        for d in searchdirs:
-            path = os.path.join(d, girname)
-            if os.path.exists(path):
-                return path
+        path = self._get_gir_index().get(girname)
+        if path is not None:
+            return path
+        searchdirs = self.get_gir_search_path()
         sys.stderr.write("Couldn't find include %r (search path: %r)\n" % (girname, searchdirs))
         sys.exit(1)
 
@@ -204,32 +415,65 @@ None."""
         if extra_include_dirs is not None:
             self.set_include_paths(extra_include_dirs)
         self.set_passthrough_mode()
-        parser = self._parse_include(filename)
-        self._namespace = parser.get_namespace()
+        self._namespace = self._parse_include(filename)
         del self._parsed_includes[self._namespace.name]
+        self._invalidate_namespace_matches()
         return self
 
+    def _parse_gir(self, filename):
+        parser = GIRParser(types_only=not self._passthrough_mode)
+        parser.parse(filename)
+        return parser.get_namespace()
+
+    def _load_pending_gir(self, filename):
+        parser = GIRParser()
+        parser.parse_header(filename)
+        pending = _PendingNamespace(parser.get_namespace(),
+                                    lambda: self._load_pending_namespace(pending, filename))
+        return pending
+
+    def _load_pending_namespace(self, pending, filename):
+        namespace = self.load_gir(filename)
+        # The nodes refer to the loaded namespace, which thus replaces the
+        # pending one, as if the include had not been lazily loaded.
+        if self._parsed_includes.get(namespace.name) is pending:
+            self._parsed_includes[namespace.name] = namespace
+            self._invalidate_namespace_matches()
+        return namespace
+
     def _parse_include(self, filename, uninstalled=False):
-        parser = None
-        if self._cachestore is not None:
-            parser = self._cachestore.load(filename)
-        if parser is None:
-            parser = GIRParser(types_only=not self._passthrough_mode)
-            parser.parse(filename)
-            if self._cachestore is not None:
-                self._cachestore.store(filename, parser)
-
-        for include in parser.get_namespace().includes:
+        if self._lazy_includes:
+            namespace = self._load_pending_gir(filename)
+        else:
+            namespace = self.load_gir(filename)
+
+        for include in namespace.includes:
             if include.name not in self._parsed_includes:
                 dep_filename = self._find_include(include)
                 self._parse_include(dep_filename)
 
         if not uninstalled:
-            for pkg in parser.get_namespace().exported_packages:
+            for pkg in namespace.exported_packages:
                 self._pkg_config_packages.add(pkg)
-        namespace = parser.get_namespace()
         self._parsed_includes[namespace.name] = namespace
-        return parser
+        self._invalidate_namespace_matches()
+        return namespace
+
+    def get_symbol_filter_prefixes(self):
+        """Return the prefixes of the lower and upper case C symbols of
+the namespace, as given to SourceScanner.set_symbol_filter(), or
+(None, None) if a symbol without them may still belong to the namespace."""
+        if self._accept_unprefixed or self._symbol_filter:
+            return None, None
+        for ns in self._iter_namespaces():
+            if not ns.symbol_prefixes:
+                return None, None
+
+        def with_separator(prefixes):
+            return [prefix if prefix.endswith('_') else prefix + '_'
+                    for prefix in prefixes]
+        return (with_separator(self._namespace.symbol_prefixes),
+                with_separator(self._namespace._ucase_symbol_prefixes))
 
     def _iter_namespaces(self):
         """Return an iterator over all included namespaces; the
@@ -238,47 +482,102 @@ currently-scanned namespace is first."""
         for ns in self._parsed_includes.itervalues():
             yield ns
 
-    def _sort_matches(self, x, y):
-        if x[0] is self._namespace:
-            return 1
-        elif y[0] is self._namespace:
-            return -1
-        return cmp(x[2], y[2])
+    def _invalidate_namespace_matches(self):
+        self._prefix_trees = None
+        self._split_cache.clear()
+        self._strip_cache.clear()
+
+    def _get_prefix_trees(self):
+        """Return, for the identifiers, the upper case symbols and the
+lower case symbols, a _PrefixTree of the prefixes of all the namespaces
+and the list of the namespaces without prefixes.  The values of the trees
+are (position, namespace, prefix index) tuples, position being the
+order of the namespace in _iter_namespaces()."""
+        if self._prefix_trees is not None:
+            return self._prefix_trees
+
+        self._prefix_trees = {}
+        for kind in ('identifier', 'ucase', 'lcase'):
+            self._prefix_trees[kind] = (_PrefixTree(), [])
+        for position, ns in enumerate(self._iter_namespaces()):
+            for kind, prefixes in [('identifier', ns.identifier_prefixes),
+                                   ('ucase', ns._ucase_symbol_prefixes),
+                                   ('lcase', ns.symbol_prefixes)]:
+                tree, unprefixed_namespaces = self._prefix_trees[kind]
+                if not prefixes:
+                    unprefixed_namespaces.append(ns)
+                for index, prefix in enumerate(prefixes):
+                    if kind != 'identifier' and not prefix.endswith('_'):
+                        prefix = prefix + '_'
+                    tree.add(prefix, (position, ns, index))
+        return self._prefix_trees
+
+    def _get_prefix_tree(self, name, is_identifier):
+        if is_identifier:
+            kind = 'identifier'
+        elif name[0].isupper():
+            kind = 'ucase'
+        else:
+            kind = 'lcase'
+        return self._get_prefix_trees()[kind]
 
-    def _split_c_string_for_namespace_matches(self, name, is_identifier=False):
-        if not is_identifier and self._symbol_filter_cmd:
-            proc = subprocess.Popen(self._symbol_filter_cmd,
-                                    stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    shell=True)
-            _name = name
-            name, err = proc.communicate(name)
-            if proc.returncode:
-                raise ValueError('filter: "%s" exited: %d with error: %s' %
-                                 (self._symbol_filter_cmd, proc.returncode, err))
+    def _can_cache_matches(self):
+        # Without prefixes, the current namespace is matched on its
+        # contents, which grow during the parse
+        for tree, unprefixed_namespaces in self._get_prefix_trees().itervalues():
+            if unprefixed_namespaces and unprefixed_namespaces[0] is self._namespace:
+                return False
+        return True
 
+    def _split_c_string_for_namespace_matches(self, name, is_identifier=False):
+        key = (name, is_identifier)
+        if key in self._split_cache:
+            self._name_cache_hits['split'] += 1
+            matches, error = self._split_cache[key]
+        else:
+            self._name_cache_misses['split'] += 1
+            matches = error = None
+            try:
+                matches = self._find_namespace_matches(name, is_identifier)
+            except ValueError as e:
+                error = e
+            if self._can_cache_matches():
+                self._split_cache[key] = (matches, error)
+        if error is not None:
+            raise error
+        return matches
+
+    def _find_namespace_matches(self, name, is_identifier):
+        if not is_identifier and self._symbol_filter:
+            name = self._symbol_filter.filter(name)
+
+        tree, unprefixed_namespaces = self._get_prefix_tree(name, is_identifier)
+
+        # The prefixes are found shortest first, which is the order of the
+        # matches, except that the current namespace is always last.  Only
+        # the first of its prefixes matching the name is used for each
+        # namespace.
+        found = []
+        first_prefixes = {}
+        for length, values in tree.iter_matches(name):
+            for position, ns, index in values:
+                found.append((ns, length, position, index))
+                if index < first_prefixes.get(position, index + 1):
+                    first_prefixes[position] = index
         matches = []  # Namespaces which might contain this name
-        unprefixed_namespaces = []  # Namespaces with no prefix, last resort
-        for ns in self._iter_namespaces():
-            if is_identifier:
-                prefixes = ns.identifier_prefixes
-            elif name[0].isupper():
-                prefixes = ns._ucase_symbol_prefixes
-            else:
-                prefixes = ns.symbol_prefixes
-            if prefixes:
-                for prefix in prefixes:
-                    if (not is_identifier) and (not prefix.endswith('_')):
-                        prefix = prefix + '_'
-                    if name.startswith(prefix):
-                        matches.append((ns, name[len(prefix):], len(prefix)))
-                        break
+        current_match = None
+        for ns, length, position, index in found:
+            if first_prefixes[position] != index:
+                continue
+            if position == 0:
+                current_match = (ns, name[length:])
             else:
-                unprefixed_namespaces.append(ns)
+                matches.append((ns, name[length:]))
+        if current_match is not None:
+            matches.append(current_match)
+
         if matches:
-            matches.sort(self._sort_matches)
-            return map(lambda x: (x[0], x[1]), matches)
+            return matches
         elif self._accept_unprefixed:
             return [(self._namespace, name)]
         elif unprefixed_namespaces:
@@ -311,16 +610,25 @@ raise ValueError."""
         return matches[-1]
 
     def strip_identifier(self, ident):
-        if self._identifier_filter_cmd:
-            proc = subprocess.Popen(self._identifier_filter_cmd,
-                                    stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    shell=True)
-            ident, err = proc.communicate(ident)
-            if proc.returncode:
-                raise ValueError('filter: "%s" exited: %d with error: %s' %
-                                 (self._identifier_filter_cmd, proc.returncode, err))
+        if ident in self._strip_cache:
+            self._name_cache_hits['strip'] += 1
+            name, error = self._strip_cache[ident]
+        else:
+            self._name_cache_misses['strip'] += 1
+            name = error = None
+            try:
+                name = self._strip_identifier(ident)
+            except TransformerException as e:
+                error = e
+            if self._can_cache_matches():
+                self._strip_cache[ident] = (name, error)
+        if error is not None:
+            raise error
+        return name
+
+    def _strip_identifier(self, ident):
+        if self._identifier_filter:
+            ident = self._identifier_filter.filter(ident)
 
         hidden = ident.startswith('_')
         if hidden:
@@ -437,9 +745,11 @@ raise ValueError."""
         # Drop functions that start with _ very early on here
         if symbol.ident.startswith('_'):
             return None
+        # Functions of other namespaces may come without their types,
+        # see SourceScanner.set_symbol_filter()
+        name = self._strip_symbol(symbol)
         parameters = list(self._create_parameters(symbol, symbol.base_type))
         return_ = self._create_return(symbol.base_type.base_type)
-        name = self._strip_symbol(symbol)
         func = ast.Function(name, return_, parameters, False, symbol.ident)
         func.add_symbol_reference(symbol)
         return func
@@ -932,7 +1242,7 @@ Note that type resolution may not succeed."""
     def _resolve_type_from_gtype_name(self, typeval):
         assert typeval.gtype_name is not None
         for ns in self._iter_namespaces():
-            node = ns.type_names.get(typeval.gtype_name, None)
+            node = ns.get_by_gtype_name(typeval.gtype_name)
             if node is not None:
                 typeval.target_giname = '%s.%s' % (ns.name, node.name)
                 return True
@@ -35,6 +35,8 @@ Well-known flags:
  * exception: Drop into debugger on fatalexception
  * warning: Drop into debugger on warning
  * posttrans: Drop into debugger just before introspectable pass
+ * cache: Print statistics about the include cache at exit
+ * name-cache: Print the hit rates of the namespace matching of C names
 """
     global _debugflags
     if _debugflags is None:
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Compare loading cached namespaces in the compact and the indexed
+# cache formats with loading them from pickles.  The indexed format,
+# which is what CacheStore.store() writes, is timed both for opening a
+# namespace and looking up one node, and for loading all of its nodes.
+# e.g.:
+#   ./benchmark-cache.py ../gir/*.gir
+
+import cPickle
+import glob
+import os
+import sys
+import time
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+for k in ['UNINSTALLED_INTROSPECTION_SRCDIR',
+          'UNINSTALLED_INTROSPECTION_BUILDDIR']:
+    if k not in os.environ:
+        os.environ[k] = path
+sys.path.insert(0, path)
+
+from giscanner import cacheformat
+from giscanner.girparser import GIRParser
+
+MIN_ROUNDS = 10
+MIN_TIME = 0.2
+
+
+def timeit(func, data):
+    rounds = 0
+    start = time.time()
+    while rounds < MIN_ROUNDS or time.time() - start < MIN_TIME:
+        func(data)
+        rounds += 1
+    return (time.time() - start) / rounds * 1000
+
+
+def lookup_indexed(data):
+    namespace = cacheformat.load_indexed_namespace(data)
+    for name in namespace:
+        namespace.get(name)
+        break
+
+
+def load_indexed(data):
+    cacheformat.load_indexed_namespace(data).names
+
+
+FORMATS = ['pickle', 'compact', 'lookup', 'indexed']
+
+
+def main(args):
+    filenames = args or sorted(glob.glob(os.path.join(path, 'gir', '*.gir')))
+    totals = {'types': [0] * 5, 'full': [0] * 5}
+    print '%-32s %6s %10s %10s %10s %10s %10s' % (('GIR', 'mode', 'parse') +
+                                                  tuple(FORMATS))
+    for filename in filenames:
+        for types_only in (True, False):
+            start = time.time()
+            parser = GIRParser(types_only=types_only)
+            parser.parse(filename)
+            parse_time = (time.time() - start) * 1000
+            namespace = parser.get_namespace()
+
+            pickled = cPickle.dumps(namespace, cPickle.HIGHEST_PROTOCOL)
+            compact = cacheformat.dumps_namespace(namespace)
+            indexed = cacheformat.dumps_indexed_namespace(namespace)
+            times = [parse_time,
+                     timeit(cPickle.loads, pickled),
+                     timeit(cacheformat.loads_namespace, compact),
+                     timeit(lookup_indexed, indexed),
+                     timeit(load_indexed, indexed)]
+            mode = 'types' if types_only else 'full'
+            for i, value in enumerate(times):
+                totals[mode][i] += value
+            print '%-32s %6s %8.2fms %8.2fms %8.2fms %8.2fms %8.2fms' % (
+                (os.path.basename(filename), mode) + tuple(times))
+    for mode in ('types', 'full'):
+        print '%-32s %6s %8.2fms %8.2fms %8.2fms %8.2fms %8.2fms' % (
+            ('total', mode) + tuple(totals[mode]))
+    for mode in ('types', 'full'):
+        pickle_time = totals[mode][1]
+        print '%s mode, speed relative to pickle: %s' % (mode, ', '.join(
+            '%s %.2fx' % (name, pickle_time / value)
+            for name, value in zip(FORMATS[1:], totals[mode][2:]) if value))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
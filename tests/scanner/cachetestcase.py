@@ -0,0 +1,30 @@
+import unittest
+import tempfile
+import shutil
+import os
+
+
+class CacheTestCase(unittest.TestCase):
+    """Runs each test in a temporary directory, which also holds the
+user cache."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ.pop('GI_SCANNER_DISABLE_CACHE', None)
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmpdir, 'cache')
+        os.mkdir(os.environ['XDG_CACHE_HOME'])
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def _write_file(self, name, contents):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, 'w') as f:
+            f.write(contents)
+        return filename
+
+    def _write_files(self, sources):
+        return [self._write_file(name, contents) for name, contents in sources]
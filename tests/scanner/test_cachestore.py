@@ -0,0 +1,334 @@
+import unittest
+import errno
+import os
+import json
+import sys
+import time
+
+path = os.getenv('UNINSTALLED_INTROSPECTION_SRCDIR', None)
+assert path is not None
+sys.path.insert(0, path)
+
+from giscanner import ast
+from giscanner import cacheformat
+from giscanner import cachestore
+from giscanner.cachestore import CacheStore
+from giscanner.girparser import GIRParser
+from giscanner.girwriter import GIRWriter
+
+from cachetestcase import CacheTestCase
+
+
+class TestCacheStore(CacheTestCase):
+    def _set_atime(self, filename, atime):
+        os.utime(filename, (atime, os.stat(filename).st_mtime))
+
+    def test_store_load(self):
+        filename = self._write_file('Foo-1.0.gir', '<repository/>')
+        store = CacheStore()
+        self.assertEqual(store.load(filename), None)
+        store.store(filename, {'foo': 'bar'})
+        self.assertEqual(store.load(filename), {'foo': 'bar'})
+
+    def test_store_load_data(self):
+        store = CacheStore()
+        self.assertEqual(store.load_data('foo'), None)
+        store.store_data('foo', {'foo': 'bar'})
+        self.assertEqual(store.load_data('foo'), {'foo': 'bar'})
+        self.assertEqual(store.load_data('bar'), None)
+        store.store_data('foo', {'foo': 'baz'})
+        self.assertEqual(store.load_data('foo'), {'foo': 'baz'})
+
+    def test_content_addressed(self):
+        os.environ['GI_SCANNER_CACHE_BY_CONTENT'] = '1'
+        first = self._write_file('Foo-1.0.gir', '<repository/>')
+        os.mkdir(os.path.join(self.tmpdir, 'other'))
+        second = self._write_file(os.path.join('other', 'Foo-1.0.gir'), '<repository/>')
+        third = self._write_file('Bar-1.0.gir', '<repository></repository>')
+
+        store = CacheStore()
+        store.store(first, {'foo': 'bar'})
+        self.assertEqual(store.load(second), {'foo': 'bar'})
+        self.assertEqual(store.load(third), None)
+
+    def test_variants(self):
+        filename = self._write_file('Foo-1.0.gir', '<repository/>')
+        store = CacheStore()
+        store.store(filename, 'types', 'types')
+        self.assertEqual(store.load(filename, 'full'), None)
+        store.store(filename, 'full', 'full')
+        self.assertEqual(store.load(filename, 'types'), 'types')
+        self.assertEqual(store.load(filename, 'full'), 'full')
+        self.assertEqual(store.load(filename), None)
+
+        store.store_system(filename, 'system', 'full')
+        store.clean_system(self.tmpdir, [filename])
+        self.assertEqual(store.load(filename, 'full'), 'system')
+
+    def test_schema_version(self):
+        filename = self._write_file('Foo-1.0.gir', '<repository/>')
+        version = cachestore._CACHE_SCHEMA_VERSION
+        store = CacheStore()
+        store.store(filename, 'current')
+        try:
+            # Another scanner version keeps its own entries, without
+            # invalidating the ones of this version.
+            cachestore._CACHE_SCHEMA_VERSION = version + '.other'
+            other = CacheStore()
+            self.assertEqual(other.load(filename), None)
+            other.store(filename, 'other')
+            self.assertEqual(other.load(filename), 'other')
+        finally:
+            cachestore._CACHE_SCHEMA_VERSION = version
+        self.assertEqual(CacheStore().load(filename), 'current')
+
+    def test_entry_header(self):
+        filename = self._write_file('Foo-1.0.gir', '<repository/>')
+        store = CacheStore()
+        store.store(filename, 'current')
+        store_filename = store._get_filename(filename)
+        with open(store_filename, 'rb') as f:
+            data = f.read()
+        with open(store_filename, 'wb') as f:
+            f.write(data.replace(cachestore._CACHE_SCHEMA_VERSION, 'x', 1))
+        self.assertEqual(store.load(filename), None)
+        self.assertFalse(os.path.exists(store_filename))
+
+    def test_system_cache(self):
+        girdir = os.path.join(self.tmpdir, 'gir-1.0')
+        os.mkdir(girdir)
+        filename = self._write_file(os.path.join('gir-1.0', 'Foo-1.0.gir'), '<repository/>')
+        other = self._write_file(os.path.join('gir-1.0', 'Bar-1.0.gir'), '<repository/>')
+
+        store = CacheStore()
+        store.store(filename, 'user')
+        store.store_system(filename, 'system')
+        store.store_system(other, 'other')
+        self.assertEqual(store.load(filename), 'system')
+
+        # The system cache keys do not depend on the user settings
+        os.environ['GI_SCANNER_CACHE_BY_CONTENT'] = '1'
+        self.assertEqual(CacheStore().load(filename), 'system')
+        del os.environ['GI_SCANNER_CACHE_BY_CONTENT']
+
+        # The system cache is used even if the user cache is disabled
+        os.environ['GI_SCANNER_DISABLE_CACHE'] = '1'
+        store = CacheStore()
+        self.assertEqual(store.load(filename), 'system')
+        self.assertEqual(store.load(other), 'other')
+
+        store.clean_system(girdir, [filename])
+        self.assertEqual(store.load(filename), 'system')
+        self.assertEqual(store.load(other), None)
+
+    def test_load_or_create(self):
+        filename = self._write_file('Foo-1.0.gir', '<repository/>')
+        created = []
+
+        def create(filename):
+            created.append(filename)
+            return 'foo'
+
+        store = CacheStore()
+        self.assertEqual(store.load_or_create(filename, create), 'foo')
+        self.assertEqual(store.load_or_create(filename, create), 'foo')
+        self.assertEqual(created, [filename])
+        self.assertEqual([f for f in os.listdir(store._directory) if f.startswith('.')], [])
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "requires fork()")
+    def test_load_or_create_concurrent(self):
+        filename = self._write_file('Foo-1.0.gir', '<repository/>')
+        read_fd, write_fd = os.pipe()
+
+        pid = os.fork()
+        if pid == 0:
+            # Another process which starts creating the entry first
+            try:
+                os.close(read_fd)
+                store = CacheStore()
+                store_filename = store._get_filename(filename)
+                store._lock(store_filename)
+                os.write(write_fd, 'x')
+                time.sleep(0.2)
+                store.store(filename, 'winner')
+                store._unlock(store_filename)
+            finally:
+                os._exit(0)
+
+        os.close(write_fd)
+        os.read(read_fd, 1)
+        os.close(read_fd)
+
+        # Waits for the other process instead of creating the entry
+        store = CacheStore()
+        self.assertEqual(store.load_or_create(filename, lambda filename: 'loser'), 'winner')
+        os.waitpid(pid, 0)
+
+    def test_stale_lock(self):
+        filename = self._write_file('Foo-1.0.gir', '<repository/>')
+        store = CacheStore()
+        store_filename = store._get_filename(filename)
+        self.assertTrue(store._lock(store_filename))
+        lock_filename = store._get_lock_filename(store_filename)
+        os.utime(lock_filename, (0, 0))
+        self.assertEqual(store.load_or_create(filename, lambda filename: 'foo'), 'foo')
+        self.assertFalse(os.path.exists(lock_filename))
+
+    def test_statistics(self):
+        cachestore.statistics = cachestore.CacheStatistics()
+        filename = self._write_file('Foo-1.0.gir', '<repository/>')
+        store = CacheStore()
+        self.assertEqual(store.load(filename), None)
+        store.store(filename, 'foo')
+        self.assertEqual(store.load(filename), 'foo')
+        os.utime(filename, (time.time() + 10, time.time() + 10))
+        self.assertEqual(store.load(filename), None)
+        # None is a hit when it is what was stored
+        store.store_data('none', None)
+        self.assertEqual(store.load_data('none'), None)
+
+        stats = cachestore.statistics.as_dict()
+        self.assertEqual(stats['hits'], {'system': 0, 'user': 2})
+        self.assertEqual(stats['misses']['missing'], 1)
+        self.assertEqual(stats['misses']['stale'], 1)
+        self.assertTrue(stats['bytes_written'] > 0)
+        self.assertEqual(stats['bytes_read'], stats['bytes_written'])
+
+        stats_filename = os.path.join(self.tmpdir, 'stats.json')
+        os.environ['GI_SCANNER_CACHE_STATS'] = stats_filename
+        cachestore._report_statistics()
+        cachestore._report_statistics()
+        with open(stats_filename) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['hits'], stats['hits'])
+        self.assertEqual(lines[0]['pid'], os.getpid())
+
+    def test_prune_entries(self):
+        os.environ['GI_SCANNER_CACHE_MAX_ENTRIES'] = '4'
+        filenames = [self._write_file('Foo%d-1.0.gir' % (i, ), '<repository/>')
+                     for i in range(4)]
+        store = CacheStore()
+        for i, filename in enumerate(filenames):
+            store.store(filename, i)
+            self._set_atime(store._get_filename(filename), i)
+        # Mark the oldest entry as recently used
+        self.assertEqual(store.load(filenames[0]), 0)
+        self.assertEqual(store.prune(), 0)
+
+        # Going over the limit evicts the least recently used entries
+        new = self._write_file('Bar-1.0.gir', '<repository/>')
+        store.store(new, 'bar')
+        self.assertEqual(store.load(filenames[0]), 0)
+        self.assertEqual(store.load(filenames[1]), None)
+        self.assertEqual(store.load(filenames[2]), None)
+        self.assertEqual(store.load(filenames[3]), 3)
+        self.assertEqual(store.load(new), 'bar')
+
+    def test_prune_size(self):
+        os.environ['GI_SCANNER_CACHE_MAX_SIZE'] = '1k'
+        first = self._write_file('Foo-1.0.gir', '<repository/>')
+        second = self._write_file('Bar-1.0.gir', '<repository/>')
+        store = CacheStore()
+        store.store(first, 'x' * 600)
+        self._set_atime(store._get_filename(first), 0)
+        store.store(second, 'y' * 600)
+        self.assertEqual(store.load(first), None)
+        self.assertEqual(store.load(second), 'y' * 600)
+
+    def test_prune_listing(self):
+        os.environ['GI_SCANNER_CACHE_MAX_ENTRIES'] = '4'
+        filenames = [self._write_file('Foo%d-1.0.gir' % (i, ), '<repository/>')
+                     for i in range(5)]
+        store = CacheStore()
+        listings = []
+        get_entries = store._get_entries
+
+        def _get_entries():
+            listings.append(None)
+            return get_entries()
+        store._get_entries = _get_entries
+
+        # The cache directory is only listed by the first store, until
+        # the stored entries may exceed the limit
+        for filename in filenames[:4]:
+            store.store(filename, 'x')
+        self.assertEqual(len(listings), 1)
+        store.store(filenames[4], 'x')
+        self.assertEqual(len(listings), 2)
+        self.assertEqual(len(os.listdir(store._directory)), 3)
+
+    def test_prune_mapped(self):
+        os.environ['GI_SCANNER_CACHE_MAX_ENTRIES'] = '4'
+        filenames = [self._write_file('Foo%d-1.0.gir' % (i, ), '<repository/>')
+                     for i in range(5)]
+        store = CacheStore()
+        for i, filename in enumerate(filenames[:4]):
+            store.store(filename, i)
+            self._set_atime(store._get_filename(filename), i)
+
+        # Windows refuses to remove entries which are still mapped
+        mapped = store._get_filename(filenames[0])
+        unlink = os.unlink
+
+        def _unlink(filename):
+            if filename == mapped:
+                raise OSError(errno.EACCES, 'Permission denied', filename)
+            unlink(filename)
+        os.unlink = _unlink
+        try:
+            store.store(filenames[4], 4)
+        finally:
+            os.unlink = unlink
+        # The mapped entry is kept and the next ones are evicted instead
+        self.assertEqual(store.load(filenames[0]), 0)
+        self.assertEqual(store.load(filenames[1]), None)
+        self.assertEqual(store.load(filenames[2]), None)
+        self.assertEqual(store.load(filenames[3]), 3)
+        self.assertEqual(store.load(filenames[4]), 4)
+
+    def test_namespace(self):
+        filename = os.path.join(path, 'tests', 'scanner', 'Regress-1.0-expected.gir')
+        parser = GIRParser(types_only=False)
+        parser.parse(filename)
+        namespace = parser.get_namespace()
+
+        store = CacheStore()
+        store.store(filename, namespace)
+        with open(store._get_filename(filename), 'rb') as f:
+            f.readline()
+            self.assertTrue(f.read().startswith(cacheformat.INDEXED_MAGIC))
+        loaded = store.load(filename)
+        self.assertTrue(isinstance(loaded, ast.Namespace))
+        self.assertEqual(list(loaded.names), list(namespace.names))
+        self.assertEqual(GIRWriter(loaded).get_xml(), GIRWriter(namespace).get_xml())
+
+    def test_lazy_namespace(self):
+        filename = os.path.join(path, 'tests', 'scanner', 'Regress-1.0-expected.gir')
+        parser = GIRParser(types_only=False)
+        parser.parse(filename)
+        namespace = parser.get_namespace()
+
+        store = CacheStore()
+        store.store(filename, namespace)
+        loaded = store.load(filename)
+        self.assertTrue(isinstance(loaded, cacheformat.LazyNamespace))
+        self.assertTrue('TestObj' in loaded)
+        self.assertEqual(list(loaded), list(namespace))
+
+        node = loaded.get('TestObj')
+        self.assertEqual(node.ctype, 'RegressTestObj')
+        self.assertTrue(node.namespace is loaded)
+        self.assertTrue(loaded.get_by_ctype('RegressTestObj') is node)
+        self.assertTrue(loaded.get_by_gtype_name('RegressTestObj') is node)
+        method = loaded.get_by_symbol('regress_test_obj_do_matrix')
+        self.assertTrue(method in node.methods)
+        self.assertEqual(loaded.get('DoesNotExist'), None)
+        self.assertFalse(loaded._complete)
+
+        self.assertEqual(sorted(loaded.symbols), sorted(namespace.symbols))
+        self.assertTrue(loaded._complete)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,12 @@ import unittest
 import tempfile
 import os
 
-from giscanner.sourcescanner import SourceScanner
+from giscanner.cachestore import CacheStore
+from giscanner.message import get_filename
+from giscanner.sourcescanner import (SourceScanner, CSYMBOL_TYPE_TYPEDEF,
+                                     CTYPE_STRUCT)
+
+from cachetestcase import CacheTestCase
 
 
 two_typedefs_source = """
@@ -21,12 +26,12 @@ typedef struct _eggs Eggs;
 class Test(unittest.TestCase):
     def setUp(self):
         self.ss = SourceScanner()
-        tmp_fd, tmp_name = tempfile.mkstemp()
+        tmp_fd, self.filename = tempfile.mkstemp()
         file = os.fdopen(tmp_fd, 'wt')
         file.write(two_typedefs_source)
         file.close()
 
-        self.ss.parse_files([tmp_name])
+        self.ss.parse_files([self.filename])
 
     def test_get_symbols_length_consistency(self):
         self.assertEqual(len(list(self.ss.get_symbols())), 2)
@@ -36,6 +41,312 @@ class Test(unittest.TestCase):
         self.assertEqual(len(list(self.ss.get_comments())), 2)
         self.assertEqual(len(list(self.ss.get_comments())), 2)
 
+    def test_get_symbols_types(self):
+        symbols = list(self.ss.get_symbols())
+        self.assertEqual([symbol.ident for symbol in symbols], ['Spam', 'Eggs'])
+        for symbol in symbols:
+            self.assertEqual(symbol.type, CSYMBOL_TYPE_TYPEDEF)
+            self.assertEqual(symbol.base_type.type, CTYPE_STRUCT)
+        self.assertEqual(symbols[0].base_type.name, '_spam')
+
+    def test_file_ids(self):
+        filename = os.path.realpath(self.filename)
+        symbols = list(self.ss.get_symbols())
+        self.assertEqual(symbols[0].file_id, symbols[1].file_id)
+        self.assertEqual(symbols[0].source_filename, filename)
+        self.assertEqual(symbols[0].position.filename, filename)
+        for comment, file_id, line in self.ss.get_comments():
+            self.assertEqual(file_id, symbols[0].file_id)
+            self.assertEqual(get_filename(file_id), filename)
+
+
+filtered_source = """
+int spam_var;
+
+void spam_func (int value);
+
+void eggs_func (int value);
+
+void _spam_private (void);
+
+#define SPAM_VALUE 1
+"""
+
+
+class TestSymbolFilter(unittest.TestCase):
+    def setUp(self):
+        self.ss = SourceScanner()
+        tmp_fd, self.filename = tempfile.mkstemp(suffix='.h')
+        file = os.fdopen(tmp_fd, 'wt')
+        file.write(filtered_source)
+        file.close()
+
+        self.ss.parse_files([self.filename])
+        self.ss.parse_macros([self.filename])
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_no_prefixes(self):
+        self.ss.set_symbol_filter()
+        symbols = [symbol.ident for symbol in self.ss.get_symbols()]
+        self.assertEqual(symbols, ['spam_func', 'eggs_func', 'SPAM_VALUE'])
+
+    def test_prefixes(self):
+        self.ss.set_symbol_filter(['spam_'], ['SPAM_'])
+        symbols = dict((symbol.ident, symbol) for symbol in self.ss.get_symbols())
+        self.assertEqual(sorted(symbols), ['SPAM_VALUE', 'eggs_func', 'spam_func'])
+        self.assertEqual(symbols['SPAM_VALUE'].const_int, 1)
+        self.assertNotEqual(symbols['spam_func'].base_type, None)
+        # Outside of the namespace, only kept to be reported
+        self.assertEqual(symbols['eggs_func'].base_type, None)
+
+
+source_with_macros = """
+#define SPAM_VALUE 42
+
+static const char *s = "/** not a comment */";
+
+/**
+ * spam_func:
+ */
+void spam_func (void) { }
+"""
+
+
+class TestMacros(unittest.TestCase):
+    def setUp(self):
+        self.ss = SourceScanner()
+        tmp_fd, self.filename = tempfile.mkstemp(suffix='.c')
+        file = os.fdopen(tmp_fd, 'wt')
+        file.write(source_with_macros)
+        file.close()
+
+        self.ss.parse_files([self.filename])
+        self.ss.parse_macros([self.filename])
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_comments(self):
+        comments = self.ss.get_comments()
+        self.assertEqual(len(comments), 1)
+        self.assertEqual(comments[0][0], '/**\n * spam_func:\n */')
+        self.assertEqual(comments[0][2], 6)
+
+    def test_macros(self):
+        symbols = [symbol.ident for symbol in self.ss.get_symbols()]
+        self.assertEqual(symbols, ['SPAM_VALUE'])
+
+    def test_parse_comments(self):
+        ss = SourceScanner()
+        ss.parse_comments([self.filename])
+        self.assertEqual(ss.get_comments(), self.ss.get_comments())
+        self.assertEqual(list(ss.get_symbols()), [])
+
+
+dependency_source = """
+typedef int DepInt;
+
+enum {
+  DEP_VALUE = 41
+};
+"""
+
+library_source = """
+#include "dep.h"
+
+DepInt spam_get (void);
+
+typedef enum {
+  SPAM_VALUE = DEP_VALUE + 1
+} SpamValue;
+"""
+
+
+class TestBaseline(CacheTestCase):
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.filename, _ = self._write_files([('spam.h', library_source),
+                                              ('dep.h', dependency_source)])
+
+    def _scan(self):
+        ss = SourceScanner()
+        ss.set_baseline_cache(CacheStore())
+        ss.set_cpp_options([self.tmpdir], [], [])
+        ss.parse_files([self.filename])
+        symbols = [(s.type, s.ident, s.line, s.base_type.type,
+                    [(child.ident, child.const_int) for child in s.base_type.child_list])
+                   for s in ss.get_symbols()]
+        return ss, symbols
+
+    def test_baseline(self):
+        ss, symbols = self._scan()
+        self.assertEqual([symbol[1] for symbol in symbols], ['spam_get', 'SpamValue'])
+        self.assertEqual(symbols[1][4], [('SPAM_VALUE', 42)])
+        filenames, typedefs, constants = ss._scanner.get_baseline()
+        self.assertTrue(os.path.join(self.tmpdir, 'dep.h') in filenames)
+        self.assertEqual(sorted(typedef[0] for typedef in typedefs),
+                         ['DepInt', 'SpamValue'])
+
+        # The second scan skips dep.h
+        self.assertEqual(self._scan()[1], symbols)
+
+
+included_source = """
+/**
+ * Spam:
+ */
+typedef struct _spam Spam;
+"""
+
+including_source = """
+#include "spam.h"
+
+/**
+ * eggs_new:
+ */
+Spam *eggs_new (void);
+"""
+
+shared_source = """
+typedef void (*CommonFunc) (int value);
+"""
+
+sharing_source = """
+#include "common.h"
+
+void %s_func (CommonFunc func);
+"""
+
+
+class TestShards(CacheTestCase):
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.filenames = self._write_files([('eggs.h', including_source),
+                                            ('spam.h', included_source)])
+
+    def _scan(self, jobs):
+        ss = SourceScanner()
+        ss.set_jobs(jobs)
+        ss.set_cpp_options([self.tmpdir], [], [])
+        ss.parse_files(self.filenames)
+        symbols = [(s.type, s.ident, s.source_filename, s.line) for s in ss.get_symbols()]
+        return symbols, ss.get_comments()
+
+    def test_shards_merge(self):
+        symbols, comments = self._scan(1)
+        self.assertEqual(len(symbols), 2)
+        self.assertEqual(len(comments), 2)
+        self.assertEqual(self._scan(2), (symbols, comments))
+
+    def test_shared_header(self):
+        # Both shards include the same function pointer typedef
+        self._write_files([('eggs.h', sharing_source % ('eggs', )),
+                           ('spam.h', sharing_source % ('spam', )),
+                           ('common.h', shared_source)])
+        symbols, comments = self._scan(1)
+        self.assertEqual([symbol[1] for symbol in symbols if symbol[1] != 'CommonFunc'],
+                         ['eggs_func', 'spam_func'])
+        self.assertEqual(self._scan(2), (symbols, comments))
+
+
+filtered_header_source = """
+int spam_variable;
+
+void spam_func (void);
+void _spam_private (void);
+void eggs_func (void);
+"""
+
+
+class TestHeaderCache(CacheTestCase):
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.filenames = self._write_files([('eggs.h', including_source),
+                                            ('spam.h', included_source)])
+
+    def _scan(self, cache):
+        ss = SourceScanner()
+        if cache:
+            ss.set_header_cache(CacheStore())
+        ss.set_cpp_options([self.tmpdir], [], [])
+        ss.parse_files(self.filenames)
+        symbols = [(s.type, s.ident, s.source_filename, s.line) for s in ss.get_symbols()]
+        return symbols, ss.get_comments()
+
+    def test_header_cache(self):
+        expected = self._scan(False)
+        self.assertEqual(self._scan(True), expected)
+        # Served from the cache
+        self.assertEqual(self._scan(True), expected)
+
+        # spam.h changed, and eggs.h includes it
+        with open(self.filenames[1], 'a') as f:
+            f.write('typedef struct _ham Ham;\n')
+        symbols, comments = self._scan(True)
+        self.assertEqual([symbol[1] for symbol in symbols], ['Spam', 'Ham', 'eggs_new'])
+        self.assertEqual((symbols, comments), self._scan(False))
+
+    def test_symbol_filter(self):
+        filenames = self._write_files([('filtered.h', filtered_header_source)])
+
+        def scan(cache):
+            ss = SourceScanner()
+            if cache:
+                ss.set_header_cache(CacheStore())
+            ss.set_symbol_filter(['spam_'], ['SPAM_'])
+            ss.parse_files(filenames)
+            return [(s.ident, s.base_type is None) for s in ss.get_symbols()]
+
+        symbols = scan(False)
+        self.assertEqual(symbols, [('spam_func', False), ('eggs_func', True)])
+        self.assertEqual(scan(True), symbols)
+        # Served from the cache
+        self.assertEqual(scan(True), symbols)
+
+
+class TestCommentCache(CacheTestCase):
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.filenames = self._write_files([('spam.c', source_with_macros),
+                                            ('spam.h', included_source)])
+
+    def _scan(self, cache):
+        ss = SourceScanner()
+        if cache:
+            ss.set_comment_cache(CacheStore())
+        ss.parse_files(self.filenames)
+        ss.parse_macros(self.filenames)
+        return ss.get_comments()
+
+    def test_comment_cache(self):
+        comments = self._scan(False)
+        self.assertEqual([comment[0].split('\n')[1] for comment in comments],
+                         [' * spam_func:', ' * Spam:'])
+        self.assertEqual(self._scan(True), comments)
+        # Served from the cache
+        self.assertEqual(self._scan(True), comments)
+
+        # spam.c changed
+        with open(self.filenames[0], 'a') as f:
+            f.write('/**\n * spam_other:\n */\n')
+        comments = self._scan(True)
+        self.assertEqual(len(comments), 3)
+        self.assertEqual(comments, self._scan(False))
+
+    def test_cached_order(self):
+        # Both files document spam_func, the last block is the one used
+        self.filenames = self._write_files([('a.c', source_with_macros),
+                                            ('b.c', source_with_macros),
+                                            ('spam.h', included_source)])
+        comments = self._scan(False)
+        self.assertEqual([os.path.basename(comment[1]) for comment in comments],
+                         ['a.c', 'b.c', 'spam.h'])
+        self.assertEqual(self._scan(True), comments)
+        # Served from the cache
+        self.assertEqual(self._scan(True), comments)
+
 
 if __name__ == '__main__':
     unittest.main()
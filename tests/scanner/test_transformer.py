@@ -1,5 +1,6 @@
 import unittest
 import tempfile
+import shutil
 import os
 import sys
 import __builtin__
@@ -65,6 +66,177 @@ class TestIdentifierFilter(unittest.TestCase):
         xformer = Transformer(namespace, identifier_filter_cmd=cmd)
         self.assertRaises(ValueError, xformer.strip_identifier, 'test_t')
 
+    def test_lines_protocol(self):
+        cmd = r"sed -u -e 's/^test_t$/TestContext/' -e 's/^test_/Test_/' " \
+              r"-e 's/_\([a-z]\)/\u\1/g'"
+        namespace = ast.Namespace('Test', '1.0')
+        xformer = Transformer(namespace, identifier_filter_cmd=cmd,
+                              filter_cmd_protocol='lines')
+
+        self.assertEqual(xformer.strip_identifier('test_t'), 'Context')
+        self.assertEqual(xformer.strip_identifier('test_foo_bar'), 'FooBar')
+        # The same command answers both
+        self.assertEqual(xformer._identifier_filter._proc.poll(), None)
+
+    def test_lines_protocol_exited(self):
+        namespace = ast.Namespace('Test', '1.0')
+        xformer = Transformer(namespace, identifier_filter_cmd='head -n 1',
+                              filter_cmd_protocol='lines')
+        self.assertEqual(xformer.strip_identifier('TestFoo'), 'Foo')
+        self.assertRaises(ValueError, xformer.strip_identifier, 'TestBar')
+
+
+class TestSymbolFilter(unittest.TestCase):
+    def test_symbol_filter_prefixes(self):
+        namespace = ast.Namespace('Test', '1.0', symbol_prefixes=['test', 'tst_'])
+        xformer = Transformer(namespace)
+        self.assertEqual(xformer.get_symbol_filter_prefixes(),
+                         (['test_', 'tst_'], ['TEST_', 'TST_']))
+
+    def test_accept_unprefixed(self):
+        namespace = ast.Namespace('Test', '1.0')
+        xformer = Transformer(namespace, accept_unprefixed=True)
+        self.assertEqual(xformer.get_symbol_filter_prefixes(), (None, None))
+
+
+class TestNamespaceMatches(unittest.TestCase):
+    def setUp(self):
+        self.namespace = ast.Namespace('Test', '1.0')
+        self.xformer = Transformer(self.namespace)
+        self.includes = [ast.Namespace('T', '1.0', symbol_prefixes=['t', 't_x']),
+                         ast.Namespace('TestFoo', '1.0')]
+        for include in self.includes:
+            self.xformer._parsed_includes[include.name] = include
+
+    def test_identifier_matches(self):
+        matches = self.xformer.split_ctype_namespaces('TestFooBar')
+        self.assertEqual([(ns.name, name) for ns, name in matches],
+                         [('T', 'estFooBar'), ('TestFoo', 'Bar'), ('Test', 'FooBar')])
+
+    def test_symbol_matches(self):
+        matches = self.xformer.split_csymbol_namespaces('test_foo_bar')
+        self.assertEqual([(ns.name, name) for ns, name in matches],
+                         [('TestFoo', 'bar'), ('Test', 'foo_bar')])
+        # Only the first matching prefix of a namespace is used
+        self.assertEqual(self.xformer.split_csymbol('t_x_bar'), (self.includes[0], 'x_bar'))
+        self.assertEqual(self.xformer.split_csymbol('T_X_BAR'), (self.includes[0], 'X_BAR'))
+        self.assertRaises(ValueError, self.xformer.split_csymbol, 'bar')
+
+    def test_cached_matches(self):
+        self.assertEqual(self.xformer.strip_identifier('TestFooBar'), 'FooBar')
+        self.assertEqual(self.xformer.strip_identifier('TestFooBar'), 'FooBar')
+        self.assertRaises(ValueError, self.xformer.split_csymbol, 'bar_baz')
+        self.assertRaises(ValueError, self.xformer.split_csymbol, 'bar_baz')
+        self.assertEqual(self.xformer._name_cache_hits, {'split': 1, 'strip': 1})
+
+        # Registering an include invalidates the cache
+        bar = ast.Namespace('Bar', '1.0')
+        self.xformer._parsed_includes['Bar'] = bar
+        self.xformer._invalidate_namespace_matches()
+        self.assertEqual(self.xformer.split_csymbol('bar_baz'), (bar, 'baz'))
+
+    def test_register_include(self):
+        self.assertRaises(ValueError, self.xformer.split_csymbol, 'ham_new')
+        self.assertRaises(ValueError, self.xformer.split_ctype_namespaces, 'HamObject')
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmpdir, 'Ham-1.0.gir'), 'w') as f:
+                f.write(gir_template % dict(name='Ham', prefix='ham', includes=''))
+            self.xformer.set_include_paths([tmpdir])
+            self.xformer.register_include(ast.Include('Ham', '1.0'))
+        finally:
+            shutil.rmtree(tmpdir)
+        ham = self.xformer._parsed_includes['Ham']
+        self.assertEqual(self.xformer.split_csymbol('ham_new'), (ham, 'new'))
+        self.assertEqual(self.xformer.split_ctype_namespaces('HamObject'), [(ham, 'Object')])
+
+
+gir_template = """<?xml version="1.0"?>
+<repository version="1.2"
+            xmlns="http://www.gtk.org/introspection/core/1.0"
+            xmlns:c="http://www.gtk.org/introspection/c/1.0">
+  %(includes)s
+  <namespace name="%(name)s" version="1.0"
+             c:identifier-prefixes="%(name)s" c:symbol-prefixes="%(prefix)s">
+    <record name="Object" c:type="%(name)sObject"/>
+  </namespace>
+</repository>
+"""
+
+
+class TestLazyIncludes(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name, prefix, includes in [('Spam', 'spam', ['Eggs']), ('Eggs', 'eggs', [])]:
+            includes = ''.join('<include name="%s" version="1.0"/>' % (include, )
+                               for include in includes)
+            with open(os.path.join(self.tmpdir, name + '-1.0.gir'), 'w') as f:
+                f.write(gir_template % dict(name=name, prefix=prefix, includes=includes))
+
+        self.xformer = Transformer(ast.Namespace('Test', '1.0'))
+        self.xformer.set_include_paths([self.tmpdir])
+        self.xformer.set_lazy_includes()
+        self.xformer.register_include(ast.Include('Spam', '1.0'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_prefixes(self):
+        eggs = self.xformer._parsed_includes['Eggs']
+        self.assertEqual(eggs.symbol_prefixes, ['eggs'])
+        self.assertEqual(self.xformer.split_csymbol('eggs_new'), (eggs, 'new'))
+        self.assertFalse('names' in eggs.__dict__)
+
+    def test_lookup(self):
+        pending = self.xformer.split_csymbol('eggs_new')[0]
+        node = self.xformer.lookup_giname('Eggs.Object')
+        self.assertEqual(node.ctype, 'EggsObject')
+        eggs = self.xformer._parsed_includes['Eggs']
+        self.assertTrue(node.namespace is eggs)
+        self.assertTrue('names' in eggs.__dict__)
+        self.assertEqual(self.xformer.split_csymbol('eggs_new'), (eggs, 'new'))
+        self.assertTrue(pending.get('Object') is node)
+        self.assertFalse('names' in self.xformer._parsed_includes['Spam'].__dict__)
+
+        typeval = self.xformer.create_type_from_ctype_string('SpamObject*')
+        self.assertTrue(self.xformer.resolve_type(typeval))
+        self.assertEqual(typeval.target_giname, 'Spam.Object')
+
+
+class TestIncludeSearchPath(unittest.TestCase):
+    def setUp(self):
+        self.tmpdirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        for tmpdir in self.tmpdirs:
+            open(os.path.join(tmpdir, 'Spam-1.0.gir'), 'w').close()
+        open(os.path.join(self.tmpdirs[1], 'Eggs-1.0.gir'), 'w').close()
+        self.xformer = Transformer(ast.Namespace('Test', '1.0'))
+        self.xformer.set_include_paths(self.tmpdirs)
+
+    def tearDown(self):
+        for tmpdir in self.tmpdirs:
+            shutil.rmtree(tmpdir)
+
+    def test_find_include(self):
+        self.assertEqual(self.xformer._find_include(ast.Include('Spam', '1.0')),
+                         os.path.join(self.tmpdirs[0], 'Spam-1.0.gir'))
+        self.assertEqual(self.xformer._find_include(ast.Include('Eggs', '1.0')),
+                         os.path.join(self.tmpdirs[1], 'Eggs-1.0.gir'))
+
+        self.xformer.set_include_paths(self.tmpdirs[::-1])
+        self.assertEqual(self.xformer._find_include(ast.Include('Spam', '1.0')),
+                         os.path.join(self.tmpdirs[1], 'Spam-1.0.gir'))
+
+    def test_missing_include(self):
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            self.assertRaises(SystemExit, self.xformer._find_include,
+                              ast.Include('Ham', '1.0'))
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+
 
 class TestStructTypedefs(unittest.TestCase):
     def setUp(self):